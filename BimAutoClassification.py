@@ -0,0 +1,285 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+"""This module proposes classification codes for many materials and objects at once.
+
+It doesn't depend on the GUI. Codes are found with rules first, then by searching
+the label of each material, or the IFC role of each object, in the classification
+system. Proposals can be reviewed before being applied, for example:
+
+    import BimAutoClassification
+    proposals = BimAutoClassification.propose(FreeCAD.ActiveDocument.Objects,"Uniclass")
+    BimAutoClassification.apply([p for p in proposals if p["Score"] > 0.5],"Uniclass")
+
+Rules are read from <system>.rules.csv, in the classification systems folder, with
+one rule per line: the property to test (Label or IfcRole), a keyword or a regular
+expression prefixed with re:, the code to propose and an optional score between 0
+and 1 (1 by default). Lines starting with # are ignored:
+
+    Label,concrete,Pr_20_31_16_14,0.9
+    IfcRole,re:^(Wall|Curtain Wall)$,Ss_25
+
+Codes can also be converted from one system to another with a mapping table (see
+BimClassificationData.readMapping):
+
+    mapping = BimClassificationData.readMapping("uniclass-omniclass.csv")
+    count,unmapped = BimAutoClassification.convert(FreeCAD.ActiveDocument.Objects,mapping,"Uniclass","OmniClass")"""
+
+import os,re,FreeCAD,BimClassificationData
+
+# the score given to search results, by rank (see BimClassificationData.SearchIndex.getRank)
+scores = [1.0,0.7,0.9,0.7,0.5]
+
+# the score of an item matching only some of the words searched, times the part it matches
+partialScore = 0.4
+
+
+class Rule:
+
+
+    "a rule that proposes a code for the objects whose given property matches a keyword or a regex"
+
+    def __init__(self,prop,pattern,code,score=1.0):
+
+        self.prop = prop
+        self.code = code
+        self.score = score
+        self.regex = None
+        self.keyword = None
+        if pattern.startswith("re:"):
+            self.regex = re.compile(pattern[3:],re.IGNORECASE)
+        else:
+            self.keyword = pattern.lower()
+
+    def match(self,value):
+
+        if self.regex:
+            return bool(self.regex.search(value))
+        return self.keyword in value.lower()
+
+
+def getRulesPath(system):
+
+    return os.path.join(BimClassificationData.getPresetDir(),system+".rules.csv")
+
+
+def readRules(filename):
+
+    "returns the list of rules of the given CSV file"
+
+    rules = []
+    for row in BimClassificationData.readCSV(filename):
+        if (len(row) < 3) or (not row[0] in ["Label","IfcRole"]):
+            FreeCAD.Console.PrintWarning("Skipping invalid classification rule: "+",".join(row)+"\n")
+            continue
+        score = 1.0
+        if (len(row) > 3) and row[3]:
+            try:
+                score = float(row[3])
+            except ValueError:
+                FreeCAD.Console.PrintWarning("Skipping invalid classification rule: "+",".join(row)+"\n")
+                continue
+        rules.append(Rule(row[0],row[1],row[2],score))
+    return rules
+
+
+def getCode(obj):
+
+    "returns the StandardCode of a material or an object, None if it can't have one"
+
+    if obj.isDerivedFrom("App::MaterialObject"):
+        return obj.Material.get("StandardCode","")
+    if hasattr(obj,"StandardCode"):
+        return obj.StandardCode
+    return None
+
+
+def setCode(obj,value):
+
+    if obj.isDerivedFrom("App::MaterialObject"):
+        m = obj.Material
+        m["StandardCode"] = value
+        obj.Material = m
+    else:
+        obj.StandardCode = value
+
+
+
+class Classifier:
+
+
+    """finds the best code of a classification system for a label and an IFC role. Results
+    are cached, as many objects share the same label or role"""
+
+    def __init__(self,system,rules=[],index=None):
+
+        self.system = system
+        self.index = index or BimClassificationData.SearchIndex(system)
+        self.rules = []
+        self.invalid = [] # rules whose code isn't in the system
+        for rule in rules:
+            if system.find(rule.code) < 0:
+                self.invalid.append(rule)
+            else:
+                self.rules.append(rule)
+        self.cache = {}
+
+    def search(self,text,reason):
+
+        """returns a (code,score,reason) tuple for the best search result of text, or None.
+        If no item matches all the words of text, the item matching most of them is used"""
+
+        key = (text,reason)
+        if not key in self.cache:
+            result = None
+            found = self.index.find(text,limit=1)
+            if found:
+                rank = self.index.getRank(found[0],text.strip().lower())[0]
+                result = (self.system.ids[found[0]],scores[rank],reason)
+            else:
+                found = self.index.findPartial(text,limit=1)
+                if found:
+                    result = (self.system.ids[found[0][0]],partialScore*found[0][1],reason)
+            self.cache[key] = result
+        return self.cache[key]
+
+    def classify(self,label,role=None,searchLabel=True):
+
+        """returns a (code,score,reason) tuple for the given label and IFC role, or None.
+        Rules are tried first, then the label if searchLabel is True, then the role"""
+
+        best = None
+        for rule in self.rules:
+            if rule.prop == "Label":
+                value = label
+            else:
+                value = role
+            if value and rule.match(value):
+                if (not best) or (rule.score > best[1]):
+                    best = (rule.code,rule.score,"rule")
+        for text,search,reason in [(label,searchLabel,"label"),(role,True,"role")]:
+            if (best and (best[1] >= 1.0)) or (not text) or (not search):
+                continue
+            result = self.search(text,reason)
+            if result and ((not best) or (result[1] > best[1])):
+                best = result
+        return best
+
+
+def propose(objs,system,rules=None,overwrite=False):
+
+    """returns a list of proposals for the materials and objects with a StandardCode
+    among objs, as dictionaries with Name, Label, Current, Code, Score and Reason
+    keys. Objects that already have a code are skipped unless overwrite is True.
+    Rules default to the rules file of the system, if any"""
+
+    classes = BimClassificationData.getSystem(system)
+    if not classes:
+        return []
+    if rules is None:
+        rules = []
+        if os.path.exists(getRulesPath(system)):
+            rules = readRules(getRulesPath(system))
+    classifier = Classifier(classes,rules,BimClassificationData.getIndex(system))
+    for rule in classifier.invalid:
+        FreeCAD.Console.PrintWarning("Code "+rule.code+" of classification rule not found in "+system+"\n")
+    proposals = []
+    for obj in objs:
+        current = getCode(obj)
+        if (current is None) or (current and not overwrite):
+            continue
+        if obj.isDerivedFrom("App::MaterialObject"):
+            result = classifier.classify(obj.Label)
+        else:
+            # object labels are mostly names like Wall001, so only rules use them
+            result = classifier.classify(obj.Label,getattr(obj,"IfcRole",None),searchLabel=False)
+        if result:
+            proposals.append({"Name":obj.Name,"Label":obj.Label,"Current":current,
+                              "Code":result[0],"Score":result[1],"Reason":result[2]})
+    return proposals
+
+
+def apply(proposals,system,doc=None):
+
+    "writes the codes of the given proposals, in one transaction. Returns the number of changed objects"
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    doc.openTransaction("Classify objects")
+    count = 0
+    for proposal in proposals:
+        obj = doc.getObject(proposal["Name"])
+        if obj:
+            value = system+" "+proposal["Code"]
+            if getCode(obj) != value:
+                setCode(obj,value)
+                count += 1
+    if count:
+        doc.commitTransaction()
+        doc.recompute()
+    else:
+        doc.abortTransaction()
+    return count
+
+
+def convert(objs,mapping,source,target,doc=None):
+
+    """converts the StandardCode of the given materials and objects from the source
+    classification system to the target one, with the given BimClassificationData.Mapping,
+    in one transaction. Returns the number of changed objects, and a {code: [object
+    names]} dictionary of the codes of the source system that have no equivalent"""
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    systems = [source,target]+mapping.systems
+    unmapped = {}
+    doc.openTransaction("Convert classification codes")
+    count = 0
+    for obj in objs:
+        current = getCode(obj)
+        if not current:
+            continue
+        system,code = BimClassificationData.splitCode(current,systems)
+        if system != source:
+            continue
+        newcode = mapping.map(code,source,target)
+        if (not newcode) and (" " in code):
+            # a code written as "ID Name" by older versions
+            classes = BimClassificationData.getSystem(source)
+            i = classes.findCode(code) if classes else -1
+            if i >= 0:
+                code = classes.ids[i]
+                newcode = mapping.map(code,source,target)
+        if newcode:
+            setCode(obj,target+" "+newcode)
+            count += 1
+        else:
+            unmapped.setdefault(code,[]).append(obj.Name)
+    if count:
+        doc.commitTransaction()
+        doc.recompute()
+    else:
+        doc.abortTransaction()
+    if unmapped:
+        FreeCAD.Console.PrintWarning(str(len(unmapped))+" codes of "+source+" have no equivalent in "+target+": "+", ".join(sorted(unmapped))+"\n")
+    return count,unmapped
@@ -24,7 +24,7 @@ from __future__ import print_function
 
 """This module contains FreeCAD commands for the BIM workbench"""
 
-import os,FreeCAD,FreeCADGui,Arch_rc
+import os,FreeCAD,FreeCADGui,Arch_rc,BimModels
 from PySide import QtCore,QtGui
 
 
@@ -51,8 +51,7 @@ class BIM_Classification:
     def Activated(self):
 
         # init checks
-        if not hasattr(self,"Classes"):
-            self.Classes = {}
+        self.loader = None
 
         # load the form and set the tree model up
         self.form = FreeCADGui.PySideUic.loadUi(os.path.join(os.path.dirname(__file__),"dialogClassification.ui"))
@@ -67,38 +66,54 @@ class BIM_Classification:
                 self.form.groupMaterials.hide()
                 self.form.buttonApply.hide()
                 self.form.buttonRename.hide()
+                self.form.buttonAuto.hide()
 
         # fill materials list
-        for obj in FreeCAD.ActiveDocument.Objects:
-            if obj.isDerivedFrom("App::MaterialObject"):
-                s1 = obj.Label
-                s2 = ""
-                if "StandardCode" in obj.Material:
-                    s2 = obj.Material["StandardCode"]
-                it = QtGui.QTreeWidgetItem([s1,s2])
-                it.setIcon(0,QtGui.QIcon(":/icons/Arch_Material.svg"))
-                it.setToolTip(0,obj.Name)
-                self.form.treeMaterials.addTopLevelItem(it)
-                if obj in FreeCADGui.Selection.getSelection():
-                    self.form.treeMaterials.setCurrentItem(it)
+        import BimIndex,BimIcons
+        for obj in BimIndex.getMaterials():
+            s1 = obj.Label
+            s2 = ""
+            if "StandardCode" in obj.Material:
+                s2 = obj.Material["StandardCode"]
+            it = QtGui.QTreeWidgetItem([s1,s2])
+            it.setIcon(0,BimIcons.getIcon(":/icons/Arch_Material.svg"))
+            it.setToolTip(0,obj.Name)
+            self.form.treeMaterials.addTopLevelItem(it)
+            if obj in FreeCADGui.Selection.getSelection():
+                self.form.treeMaterials.setCurrentItem(it)
+
+        # classes are shown through a model that only creates the rows the tree view asks for
+        self.model = ClassificationModel()
+        self.form.treeClass.setModel(self.model)
+        self.form.treeClass.setUniformRowHeights(True)
 
         # fill available classifications
         p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetString("DefaultClassificationSystem","")
-        presetdir = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","Classification")
-        if os.path.isdir(presetdir):
-            for f in os.listdir(presetdir):
-                if f.endswith(".xml"):
-                    n = os.path.splitext(f)[0]
-                    self.form.comboSystem.addItem(n)
-                    if n == p:
-                        self.form.comboSystem.setCurrentIndex(self.form.comboSystem.count()-1)
+        import BimClassificationData
+        for n in BimClassificationData.listSystems():
+            self.form.comboSystem.addItem(n)
+            if n == p:
+                self.form.comboSystem.setCurrentIndex(self.form.comboSystem.count()-1)
+
+        # search results are only updated once typing pauses
+        self.searchTimer = QtCore.QTimer()
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(250)
+        QtCore.QObject.connect(self.searchTimer, QtCore.SIGNAL("timeout()"), self.update)
+
+        # the classes of a system being parsed are shown as they get read
+        self.streamTimer = QtCore.QTimer()
+        self.streamTimer.setInterval(100)
+        QtCore.QObject.connect(self.streamTimer, QtCore.SIGNAL("timeout()"), self.stream)
 
         # connect signals
         QtCore.QObject.connect(self.form.comboSystem, QtCore.SIGNAL("currentIndexChanged(int)"), self.update)
         QtCore.QObject.connect(self.form.buttonApply, QtCore.SIGNAL("clicked()"), self.apply)
         QtCore.QObject.connect(self.form.buttonRename, QtCore.SIGNAL("clicked()"), self.rename)
-        QtCore.QObject.connect(self.form.search, QtCore.SIGNAL("textEdited(QString)"), self.update)
+        QtCore.QObject.connect(self.form.buttonAuto, QtCore.SIGNAL("clicked()"), self.autoClassify)
+        QtCore.QObject.connect(self.form.search, QtCore.SIGNAL("textEdited(QString)"), self.delaySearch)
         QtCore.QObject.connect(self.form.buttonBox, QtCore.SIGNAL("accepted()"), self.accept)
+        QtCore.QObject.connect(self.form, QtCore.SIGNAL("rejected()"), self.reject)
 
         # center the dialog over FreeCAD window
         mw = FreeCADGui.getMainWindow()
@@ -107,9 +122,30 @@ class BIM_Classification:
         self.update()
         self.form.show()
 
-    def update(self,search=""):
+    def close(self):
+
+        "stops the timers of the dialog, and stops following the background loader"
+
+        self.searchTimer.stop()
+        self.streamTimer.stop()
+        if self.loader:
+            # the loader is shared by the module, and keeps running for other dialogs
+            try:
+                self.loader.loaded.disconnect(self.onLoaded)
+            except (RuntimeError,TypeError):
+                pass
+            self.loader = None
+
+    def reject(self):
+
+        self.close()
+
+    def delaySearch(self,text):
 
-        self.form.treeClass.clear()
+        # restarted on each keystroke
+        self.searchTimer.start()
+
+    def update(self,search=""):
 
         # save as default
         FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").SetString("DefaultClassificationSystem",self.form.comboSystem.currentText())
@@ -122,126 +158,121 @@ class BIM_Classification:
             search = search.lower()
 
         system = self.form.comboSystem.currentText()
+        if (not system) or (system != self.model.name):
+            self.model.setSystem(None)
         if not system:
             return
 
-        if not system in self.Classes:
-            self.Classes[system] = self.build(system)
-        if not self.Classes[system]:
+        # systems are parsed in the background, and shown when ready
+        import BimClassificationData
+        if not BimClassificationData.isLoaded(system):
+            loader = preload([system])
+            if loader:
+                if loader != self.loader:
+                    self.loader = loader
+                    self.loader.loaded.connect(self.onLoaded)
+                self.form.search.setPlaceholderText("Loading...")
+                self.form.progressBar.show()
+                self.streamTimer.start()
+                self.stream(search)
+                return
+        self.streamTimer.stop()
+        self.form.progressBar.hide()
+        self.form.search.setPlaceholderText("Search...")
+        classes = BimClassificationData.getSystem(system)
+        if not classes:
             return
 
-        for c in self.Classes[system]:
-            it = None
-            if not c[1]: c[1] = ""
-            if search:
-                if (search in c[0].lower()) or (search in c[1].lower()):
-                    it = QtGui.QTreeWidgetItem([c[0]+" "+c[1]])
-                    it.setToolTip(0,c[1])
-                    self.form.treeClass.addTopLevelItem(it)
-            else:
-                it = QtGui.QTreeWidgetItem([c[0]+" "+c[1]])
-                it.setToolTip(0,c[1])
-                self.form.treeClass.addTopLevelItem(it)
-            if c[2]:
-                self.addChildren(c[2],it,search)
-
-    def addChildren(self,children,parent,search=""):
+        if classes is not self.model.system:
+            self.model.setSystem(system,classes)
+        elif self.model.loading:
+            # the system was shown while it was read
+            self.model.setLoading(False)
+        if search:
+            # show the best matches of the search text, with the path of their ancestors
+            self.model.setResults(BimClassificationData.getIndex(system).find(search,limit=500))
+        else:
+            self.model.setResults(None)
 
-        if children:
-            for c in children:
-                it = None
-                if not c[1]: c[1] = ""
-                if search:
-                    if (search in c[0].lower()) or (search in c[1].lower()):
-                        it = QtGui.QTreeWidgetItem([c[0]+" "+c[1]])
-                        it.setToolTip(0,c[1])
-                        self.form.treeClass.addTopLevelItem(it)
-                else:
-                    it = QtGui.QTreeWidgetItem([c[0]+" "+c[1]])
-                    it.setToolTip(0,c[1])
-                    if parent:
-                        parent.addChild(it)
-                if c[2]:
-                    self.addChildren(c[2],it,search)
-
-    def build(self,system):
-
-        # a replacement function to parse xml that doesn't depend on expat
-
-        preset = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","Classification",system+".xml")
-        if not os.path.exists(preset):
-            return None
-        import codecs,re
-        d = Item(None)
-        with codecs.open(preset,"r","utf-8") as f:
-            currentItem = d
-            for l in f:
-                if "<Item>" in l:
-                    currentItem = Item(currentItem)
-                    currentItem.parent.children.append(currentItem)
-                if "</Item>" in l:
-                    currentItem = currentItem.parent
-                elif currentItem and re.findall("<ID>(.*?)</ID>",l):
-                    currentItem.ID = re.findall("<ID>(.*?)</ID>",l)[0]
-                elif currentItem and re.findall("<Name>(.*?)</Name>",l):
-                    currentItem.Name = re.findall("<Name>(.*?)</Name>",l)[0]
-                elif currentItem and re.findall("<Description>(.*?)</Description>",l) and not currentItem.Name:
-                    currentItem.Name = re.findall("<Description>(.*?)</Description>",l)[0]
-        return [self.listize(c) for c in d.children]
-
-    def listize(self,item):
-        return [item.ID, item.Name, [self.listize(it) for it in item.children]]
-
-    def build_xmddom(self,system):
-
-        # currently not working for me because of the infamous expat/coin bug in debian...
-
-        preset = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","Classification",system+".xml")
-        if not os.path.exists(preset):
-            return None
-        import xml.dom.minidom
-        d = xml.dom.minidom.parse(preset)
-        return self.getChildren(d.getElementsByTagName("Items")[0])
+    def stream(self,search=None):
 
-    def getChildren(self,node):
+        # shows the part of the system read so far by the loader
+        system = self.form.comboSystem.currentText()
+        if (not self.loader) or (self.loader.current != system):
+            return
+        self.form.progressBar.setValue(int(self.loader.progress*100))
+        partial = self.loader.system
+        if not partial:
+            return
+        if partial is not self.model.system:
+            self.model.setSystem(system,partial,loading=True)
+            search = self.form.search.text().lower()
+        else:
+            self.model.refresh()
+        if search:
+            # searched without caching the index, as the system is still growing
+            import BimClassificationData
+            self.model.setResults(BimClassificationData.SearchIndex(partial).find(search,limit=500))
+        elif search is not None:
+            self.model.setResults(None)
+
+    def onLoaded(self,system):
+
+        if system == self.form.comboSystem.currentText():
+            self.update()
+
+    def getSelectedClass(self):
 
-        children = []
-        for child in node.childNodes:
-            if child.hasChildNodes():
-                ID = None
-                Name = None
-                children = []
-                for tag in child.childNodes:
-                    if tag.hasChildNodes():
-                        if tag.tagName == "ID":
-                            ID = tag.childNodes[0].wholeText
-                        elif tag.tagName == "Name":
-                            Name = tag.childNodes[0].wholeText
-                        elif tag.tagName == "Children":
-                            children = self.getChildren(tag.childNodes)
-                if ID and Name:
-                    children.append([ID,name,children])
+        "returns the index of the selected class, if there is exactly one"
+
+        sel = [index for index in self.form.treeClass.selectedIndexes() if index.column() == 0]
+        if len(sel) == 1:
+            return sel[0]
+        return None
 
     def apply(self):
 
-        if self.form.treeMaterials.selectedItems() and len(self.form.treeClass.selectedItems()) == 1:
-            c = self.form.treeClass.selectedItems()[0].text(0)
+        # only the ID is stored, StandardCode values are "<system> <ID>"
+        if self.form.treeMaterials.selectedItems() and self.getSelectedClass():
+            c = self.model.getId(self.getSelectedClass())
             for m in self.form.treeMaterials.selectedItems():
                 m.setText(1,c)
 
     def rename(self):
 
-        if self.form.treeMaterials.selectedItems() and len(self.form.treeClass.selectedItems()) == 1:
-            c = self.form.treeClass.selectedItems()[0].toolTip(0)
+        if self.form.treeMaterials.selectedItems() and self.getSelectedClass():
+            c = self.getSelectedClass().data(QtCore.Qt.ToolTipRole)
             for m in self.form.treeMaterials.selectedItems():
                 m.setText(0,c)
 
+    def autoClassify(self):
+
+        """proposes classes for the selected materials, or for all the materials without
+        class. They are only written to the document when the dialog is accepted"""
+
+        import BimClassificationData,BimAutoClassification
+        system = self.form.comboSystem.currentText()
+        if not (BimClassificationData.isLoaded(system) and BimClassificationData.getSystem(system)):
+            return
+        items = self.form.treeMaterials.selectedItems()
+        if not items:
+            root = self.form.treeMaterials.invisibleRootItem()
+            items = [root.child(i) for i in range(root.childCount()) if not root.child(i).text(1)]
+        items = dict([(item.toolTip(0),item) for item in items])
+        objs = [FreeCAD.ActiveDocument.getObject(name) for name in items]
+        for proposal in BimAutoClassification.propose([o for o in objs if o],system,overwrite=True):
+            item = items[proposal["Name"]]
+            item.setText(1,proposal["Code"])
+            item.setToolTip(1,"score %.2f, from the %s" % (proposal["Score"],proposal["Reason"]))
+
     def accept(self):
 
+        import BimClassificationData
         standard = self.form.comboSystem.currentText()
         if self.form.groupMaterials.isVisible():
             root = self.form.treeMaterials.invisibleRootItem()
             first = True
+            systems = BimClassificationData.listSystems()
             for i in range(root.childCount()):
                 item = root.child(i)
                 code = item.text(1)
@@ -250,7 +281,10 @@ class BIM_Classification:
                     obj = FreeCAD.ActiveDocument.getObject(item.toolTip(0))
                     if obj:
                         m = obj.Material
-                        m["StandardCode"] = standard+" "+code
+                        # the codes already stored on the material keep their system
+                        if not [system for system in systems if code.startswith(system+" ")]:
+                            code = standard+" "+code
+                        m["StandardCode"] = code
                         if m != obj.Material:
                             if first:
                                 FreeCAD.ActiveDocument.openTransaction("Change material codes")
@@ -263,14 +297,14 @@ class BIM_Classification:
                             obj.Label = l
                         if obj.ViewObject.isEditing():
                             if hasattr(obj.ViewObject,"Proxy") and hasattr(obj.ViewObject.Proxy,"taskd"):
-                                obj.ViewObject.Proxy.taskd.form.FieldCode.setText(standard+" "+code)
+                                obj.ViewObject.Proxy.taskd.form.FieldCode.setText(code)
                                 obj.ViewObject.Proxy.taskd.form.FieldName.setText(l)
             if not first:
                 FreeCAD.ActiveDocument.commitTransaction()
                 FreeCAD.ActiveDocument.recompute()
         else:
-            if len(self.form.treeClass.selectedItems()) == 1:
-                code = self.form.treeClass.selectedItems()[0].text(0)
+            if self.getSelectedClass():
+                code = self.model.getId(self.getSelectedClass())
                 if len(FreeCADGui.Selection.getSelection()) == 1:
                     obj = FreeCADGui.Selection.getSelection()[0]
                     if obj.ViewObject.isEditing():
@@ -281,17 +315,220 @@ class BIM_Classification:
                         elif hasattr(obj,"StandardCode"):
                             obj.StandardCode = standard+" "+code
         self.form.hide()
+        self.close()
         return True
 
-class Item:
 
-    # only used by the non-expat version
 
-    def __init__(self,parent):
-        self.parent = parent
-        self.ID = None
-        self.Name = None
-        self.children = []
+class ClassificationLoader(QtCore.QThread):
+
+
+    "parses classification systems off the GUI thread, and emits the name of each loaded system"
+
+    loaded = QtCore.Signal(object)
+
+    def __init__(self,names):
+
+        QtCore.QThread.__init__(self)
+        self.names = names
+        self.current = None # the system being parsed
+        self.system = None # the ClassificationSystem being read, if it is not in the disk cache
+        self.progress = 0 # the part of the current file read so far
+        self.cancelled = False # also used as the cancel token of the parser
+
+    def run(self):
+
+        import BimClassificationData
+        for name in self.names:
+            if self.cancelled:
+                return
+            self.system = None
+            self.progress = 0
+            self.current = name
+            try:
+                BimClassificationData.getSystem(name,self)
+            except BimClassificationData.Cancelled:
+                return
+            except Exception as e:
+                # a broken preset shouldn't prevent the next ones from loading
+                FreeCAD.Console.PrintWarning("Unable to load classification system "+name+": "+str(e)+"\n")
+                BimClassificationData.setFailed(name)
+            self.loaded.emit(name)
+        self.current = None
+
+
+
+class ClassificationModel(BimModels.LazyTreeModel):
+
+
+    """a tree model of the classes of a classification system, that creates the rows
+    of a class only when it gets expanded, or shows a flat list of search results"""
+
+    def __init__(self):
+
+        BimModels.LazyTreeModel.__init__(self)
+        self.name = None
+        self.system = None
+        self.loading = False
+        self.clear()
+
+    def clear(self):
+
+        # i+1 is the item i of the system
+        BimModels.LazyTreeModel.clear(self)
+        self.children = {} # node: list of child nodes, only for the nodes expanded so far
+        self.results = None # the nodes shown at the root while searching
+
+    def setSystem(self,name,system=None,loading=False):
+
+        """shows the given BimClassificationData.ClassificationSystem. If loading is True,
+        the system is still being read, and only its complete top-level items are shown
+        until refresh() or setLoading() are called"""
+
+        self.beginResetModel()
+        self.clear()
+        self.name = name
+        self.system = system
+        self.loading = loading
+        self.endResetModel()
+
+    def setLoading(self,loading):
+
+        "shows the top-level items read so far, and the last one too if loading is False"
+
+        self.loading = loading
+        self.refresh()
+
+    def refresh(self):
+
+        "appends the top-level items read since the last call to the tree"
+
+        if (not self.system) or (not 0 in self.children):
+            return
+        children = self.children[0]
+        if children:
+            child = self.system.nextSibling[children[-1]-1]
+        else:
+            child = self.system.firstTop
+        while child >= 0:
+            self.positions[child+1] = len(children)
+            children.append(child+1)
+            child = self.system.nextSibling[child]
+        if self.loading and children and (self.system.nextSibling[children[-1]-1] < 0):
+            # the children of the last top-level item might still be read
+            children.pop()
+        if (self.results is None) and (self.fetched.get(0,0) < self.batch):
+            # the views only ask for more rows when scrolled to the end
+            self.fetchMore(QtCore.QModelIndex())
+
+    def setResults(self,results):
+
+        "shows the given item positions as a flat list, or the whole tree if None"
+
+        if (results is None) and (self.results is None):
+            return
+        self.beginResetModel()
+        self.fetched = {}
+        if results is None:
+            self.results = None
+        else:
+            self.results = [i+1 for i in results]
+        self.endResetModel()
+
+    def getChildren(self,node):
+
+        if self.results is not None:
+            if node == 0:
+                return self.results
+            return []
+        if not self.system:
+            return []
+        if not node in self.children:
+            self.children[node] = [child+1 for child in self.system.getChildren(node-1)]
+            if self.loading and (node == 0) and self.children[node]:
+                self.children[node].pop()
+            for pos,child in enumerate(self.children[node]):
+                self.positions[child] = pos
+        return self.children[node]
+
+    def getId(self,index):
+
+        "returns the ID of the class at the given index"
+
+        return self.system.ids[self.getNode(index)-1]
+
+    def getParent(self,node):
+
+        if self.results is not None:
+            return 0
+        return self.system.parents[node-1]+1
+
+    # QAbstractItemModel interface
+
+    def columnCount(self,parent=QtCore.QModelIndex()):
+
+        if self.results is not None:
+            return 2
+        return 1
+
+    def hasChildren(self,parent=QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return False
+        node = self.getNode(parent)
+        if (self.results is None) and self.system:
+            return self.system.hasChildren(node-1)
+        return bool(self.getChildren(node))
+
+    def data(self,index,role=QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+        i = self.getNode(index)-1
+        if index.column() == 0:
+            if role == QtCore.Qt.DisplayRole:
+                return self.system.ids[i]+" "+self.system.getName(i)
+            elif role == QtCore.Qt.ToolTipRole:
+                return self.system.getName(i)
+        else:
+            if role == QtCore.Qt.DisplayRole:
+                return " > ".join(self.system.getPath(i))
+            elif role == QtCore.Qt.ForegroundRole:
+                return QtGui.QBrush(QtGui.QColor("gray"))
+        return None
+
+    def flags(self,index):
+
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+
+loader = None # the ClassificationLoader currently running, if any
+
+def preload(names=None):
+
+    """parses the given classification systems in the background. By default, the default
+    system is loaded, or all of them if the PreloadAllClassificationSystems preference is
+    set. A loader busy with other systems is cancelled. Returns the running
+    ClassificationLoader, or None if the systems are already loaded"""
+
+    global loader
+    import BimClassificationData
+    if names is None:
+        if FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetBool("PreloadAllClassificationSystems",False):
+            names = BimClassificationData.listSystems()
+        else:
+            names = [FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetString("DefaultClassificationSystem","")]
+    names = [n for n in names if n and BimClassificationData.getPresetPath(n) and not BimClassificationData.isLoaded(n)]
+    if not names:
+        return None
+    if loader and loader.isRunning():
+        if loader.current == names[0]:
+            return loader
+        loader.cancelled = True
+        loader.wait()
+    loader = ClassificationLoader(names)
+    loader.start()
+    return loader
 
 
 FreeCADGui.addCommand('BIM_Classification',BIM_Classification())
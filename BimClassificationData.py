@@ -0,0 +1,865 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+"""This module reads the classification systems used by the BIM workbench.
+
+Classification systems are XML files placed in $USERAPPDATA/BIM/Classification,
+optionally gzip-compressed (.xml.gz), made of nested items like this:
+
+    <Item><ID>Ss_20</ID><Name>Structural systems</Name><Children><Item>...</Item></Children></Item>
+
+The files are read with a small streaming scanner instead of xml.dom or
+xml.etree, because these depend on expat, which conflicts with the one
+bundled with coin on some systems. It doesn't depend on FreeCAD, except to
+locate the presets folder.
+
+Parsed systems are cached in a binary file next to each preset (Uniclass.xml.cache
+for Uniclass.xml), which is used as long as the size and modification time of the
+preset don't change.
+
+Loaded systems are shared by the whole FreeCAD session, through getSystem(),
+getIndex() and lookup(). The least recently used ones are released when they
+exceed the ClassificationCacheSize preference, in megabytes.
+
+The classes of materials and objects are stored in their StandardCode as the system
+name and the class ID separated by a space, such as "Uniclass Ss_25_10". Older
+versions also appended the class name ("Uniclass Ss_25_10 Wall systems"), which
+lookup() still understands."""
+
+import os,sys,gzip,codecs,marshal,threading
+from collections import OrderedDict
+from array import array
+from bisect import bisect_left
+from heapq import nsmallest
+from xml.sax.saxutils import unescape
+
+entities = {"&quot;":'"',"&apos;":"'"}
+fields = ["ID","Name","Description"]
+tags = {} # the most common tags, pre-parsed
+for tag in ["Item","Children"]+fields:
+    tags[tag] = (tag,False)
+    tags["/"+tag] = (tag,True)
+chunksize = 65536
+cacheversion = 2 # to be increased when the format of the cache changes
+systemList = None # (presets folder, its modification time, system names), see listSystems()
+separators = dict([(ord(c),u" ") for c in "_.,;:-+/\\|()[]{}<>&'\"!?*#=~"]) # split words when searching
+
+
+class Cancelled(Exception):
+
+
+    "raised when the loading of a classification system is cancelled"
+
+
+
+def getPresetDir():
+
+    "returns the folder where classification systems are stored"
+
+    import FreeCAD
+    return os.path.join(FreeCAD.getUserAppDataDir(),"BIM","Classification")
+
+
+def listSystems():
+
+    """returns the names of the available classification systems. The folder is only
+    listed again when its modification time changes, as codes are split with this list"""
+
+    global systemList
+    presetdir = getPresetDir()
+    if not os.path.isdir(presetdir):
+        return []
+    mtime = os.path.getmtime(presetdir)
+    if (not systemList) or (systemList[0] != presetdir) or (systemList[1] != mtime):
+        systems = []
+        for f in sorted(os.listdir(presetdir)):
+            for ext in [".xml",".xml.gz"]:
+                if f.endswith(ext) and not f[:-len(ext)] in systems:
+                    systems.append(f[:-len(ext)])
+        systemList = (presetdir,mtime,systems)
+    return list(systemList[2])
+
+
+def getPresetPath(system):
+
+    "returns the file of the given classification system, or None if not found"
+
+    for ext in [".xml",".xml.gz"]:
+        preset = os.path.join(getPresetDir(),system+ext)
+        if os.path.exists(preset):
+            return preset
+    return None
+
+
+def openPreset(filename):
+
+    "opens a preset file for binary reading, decompressing it if needed"
+
+    f = open(filename,"rb")
+    if f.read(2) == b"\x1f\x8b":
+        f.close()
+        return gzip.open(filename,"rb")
+    f.seek(0)
+    return f
+
+
+def getText(chunks):
+
+    text = "".join(chunks).strip()
+    if "&" in text:
+        text = unescape(text,entities)
+        if "&#" in text:
+            text = unescapeChars(text)
+    return text
+
+
+def unescapeChars(text):
+
+    "replaces numeric character references"
+
+    result = []
+    end = 0
+    start = text.find("&#")
+    while start >= 0:
+        stop = text.find(";",start)
+        if stop < 0:
+            break
+        code = text[start+2:stop]
+        try:
+            if code[:1] in ["x","X"]:
+                char = int(code[1:],16)
+            else:
+                char = int(code)
+            try:
+                char = unichr(char)
+            except NameError:
+                char = chr(char)
+        except (ValueError,OverflowError):
+            start = text.find("&#",stop)
+            continue
+        result.append(text[end:start])
+        result.append(char)
+        end = stop+1
+        start = text.find("&#",end)
+    result.append(text[end:])
+    return "".join(result)
+
+
+def getTag(tag):
+
+    "returns the name of a tag without attributes nor namespace, and if it is a closing tag"
+
+    closing = tag[:1] == "/"
+    if closing:
+        tag = tag[1:]
+    if tag[:1] in ["?","!"] or tag[-1:] == "/" or not tag.strip():
+        return None,closing
+    return tag.split(None,1)[0].rsplit(":",1)[-1],closing
+
+
+def iterItems(filename,token=None):
+
+    """yields a (depth,ID,Name) tuple for each item of the given classification file,
+    parents before their children. The file is read in chunks, so only the items
+    currently open are kept in memory. Tags don't need to be on separate lines.
+    If token is given, Cancelled is raised as soon as token.cancelled is True, and
+    token.progress is set to the part of the file read so far, between 0 and 1"""
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    stack = [] # [ID,Name,yielded] of the currently open items
+    field = None # the tag whose text is being read
+    text = []
+    rest = "?" # the unfinished part of the previous chunk. The prolog is skipped like <?xml?>
+    size = float(max(os.path.getsize(filename),1))
+    with openPreset(filename) as f:
+        raw = getattr(f,"fileobj",None) or f # the compressed file, if any
+        while True:
+            if token:
+                if token.cancelled:
+                    raise Cancelled()
+                token.progress = min(raw.tell()/size,1.0)
+            data = f.read(chunksize)
+            # each part is a tag followed by the text that comes before the next tag
+            parts = decoder.decode(data,not data).split("<")
+            parts[0] = rest+parts[0]
+            count = len(parts)
+            if data:
+                count -= 1 # the last part might continue in the next chunk
+            rest = parts[-1]
+            i = 0
+            while i < count:
+                part = parts[i]
+                i += 1
+                if part[:1] == "!":
+                    # comments and CDATA sections can contain "<"
+                    close = None
+                    if part.startswith("!--"):
+                        close = "-->"
+                    elif part.startswith("![CDATA["):
+                        close = "]]>"
+                    if close:
+                        first = i-1
+                        while (not close in part) and (i < len(parts)):
+                            part += "<"+parts[i]
+                            i += 1
+                        if (i > count) or not (close in part):
+                            # unfinished, read again with the next chunk
+                            rest = "<".join(parts[first:])
+                            break
+                        k = part.find(close)
+                        if field:
+                            if close == "]]>":
+                                text.append(part[8:k].replace("&","&amp;"))
+                            text.append(part[k+3:])
+                        continue
+                k = part.find(">")
+                if k < 0:
+                    continue
+                tag,closing = tags.get(part[:k]) or getTag(part[:k])
+                if tag == "Item":
+                    if closing:
+                        if stack:
+                            item = stack.pop()
+                            if not item[2]:
+                                yield (len(stack),item[0],item[1] or "")
+                    else:
+                        if stack and not stack[-1][2]:
+                            stack[-1][2] = True
+                            yield (len(stack)-1,stack[-1][0],stack[-1][1] or "")
+                        stack.append([None,None,False])
+                elif tag in fields:
+                    if not closing:
+                        field = tag
+                        text = [part[k+1:]]
+                        continue
+                    elif field == tag:
+                        if stack:
+                            if tag == "ID":
+                                stack[-1][0] = getText(text)
+                            elif (tag == "Name") or not stack[-1][1]:
+                                stack[-1][1] = getText(text)
+                        field = None
+                if field:
+                    text.append(part[k+1:])
+            if not data:
+                break
+
+
+def toBytes(a):
+
+    if hasattr(a,"tobytes"):
+        return a.tobytes()
+    return a.tostring()
+
+
+def fromBytes(typecode,data):
+
+    a = array(typecode)
+    if hasattr(a,"frombytes"):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
+
+
+
+class ClassificationSystem:
+
+
+    """the items of a classification system, stored in parallel arrays instead of one
+    object per item. Items are numbered in document order, parents before their
+    children. Names are interned, since many items share the same name.
+    -1 stands for no item, and getChildren(-1) returns the top-level items"""
+
+    def __init__(self):
+
+        self.ids = [] # item: ID
+        self.nameIndex = array("i") # item: position in self.names
+        self.names = [] # the distinct names
+        self.parents = array("i") # item: parent item
+        self.firstChild = array("i") # item: first child item
+        self.nextSibling = array("i") # item: next item with the same parent
+        self.firstTop = -1 # the first top-level item
+        self.sortedIds = None # IDs and their items sorted by ID, built when needed
+        self.sortedItems = None
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def read(self,filename,token=None):
+
+        "reads the items of the given classification file. See iterItems() about token"
+
+        self.__init__()
+        nameindex = {}
+        last = [] # depth: last item added at that depth
+        for depth,ID,Name in iterItems(filename,token):
+            # the system can be shown by another thread while it is read, so an item is
+            # only linked to the others once all its data is stored, its ID last
+            i = len(self.ids)
+            if depth:
+                self.parents.append(last[depth-1])
+            else:
+                self.parents.append(-1)
+            if not Name in nameindex:
+                nameindex[Name] = len(self.names)
+                self.names.append(Name)
+            self.nameIndex.append(nameindex[Name])
+            self.firstChild.append(-1)
+            self.nextSibling.append(-1)
+            self.ids.append(ID or "")
+            if depth < len(last):
+                # the last item at this depth is the previous sibling
+                self.nextSibling[last[depth]] = i
+                del last[depth:]
+            elif depth == 0:
+                self.firstTop = i
+            else:
+                self.firstChild[last[depth-1]] = i
+            last.append(i)
+        self.sortedIds = None
+
+    def getName(self,i):
+
+        return self.names[self.nameIndex[i]]
+
+    def getSize(self):
+
+        "returns an estimate of the memory used by this system, in bytes"
+
+        size = 0
+        for a in [self.nameIndex,self.parents,self.firstChild,self.nextSibling]:
+            size += a.itemsize*len(a)
+        for table in [self.ids,self.names]:
+            # list pointer, string header and characters
+            size += 60*len(table)+sum(map(len,table))
+        if self.sortedIds is not None:
+            size += 12*len(self.sortedIds)
+        return size
+
+    def getChildren(self,i=-1):
+
+        "returns the child items of the given item, or the top-level items"
+
+        children = []
+        if i < 0:
+            child = self.firstTop
+        else:
+            child = self.firstChild[i]
+        while child >= 0:
+            children.append(child)
+            child = self.nextSibling[child]
+        return children
+
+    def hasChildren(self,i=-1):
+
+        if i < 0:
+            return self.firstTop >= 0
+        return self.firstChild[i] >= 0
+
+    def getSubtree(self,i):
+
+        "returns the range of items made of the given item and all its descendants"
+
+        end = i
+        while end >= 0:
+            if self.nextSibling[end] >= 0:
+                return range(i,self.nextSibling[end])
+            end = self.parents[end]
+        return range(i,len(self.ids))
+
+    def getPath(self,i):
+
+        "returns the IDs of the ancestors of the given item, from the top"
+
+        path = []
+        i = self.parents[i]
+        while i >= 0:
+            path.insert(0,self.ids[i])
+            i = self.parents[i]
+        return path
+
+    def find(self,ID):
+
+        "returns the item with the given ID, or -1"
+
+        if self.sortedIds is None:
+            self.sortedItems = array("i",sorted(range(len(self.ids)),key=self.ids.__getitem__))
+            self.sortedIds = [self.ids[i] for i in self.sortedItems]
+        pos = bisect_left(self.sortedIds,ID)
+        if (pos < len(self.sortedIds)) and (self.sortedIds[pos] == ID):
+            return self.sortedItems[pos]
+        return -1
+
+    def findCode(self,code):
+
+        """returns the item with the given ID, or with the longest ID followed by a space
+        the given code starts with, as in the "ID Name" codes of older versions, or -1.
+        IDs can contain spaces too"""
+
+        i = self.find(code)
+        words = code.split(" ")
+        while (i < 0) and (len(words) > 1):
+            words.pop()
+            i = self.find(" ".join(words))
+        return i
+
+    def dump(self,f):
+
+        "writes the system to an open binary file"
+
+        marshal.dump((toBytes(self.nameIndex),toBytes(self.parents),toBytes(self.firstChild),
+                      toBytes(self.nextSibling),self.firstTop,"\x00".join(self.ids),"\x00".join(self.names)),f)
+
+    def load(self,f):
+
+        "reads a system written by dump()"
+
+        data = marshal.load(f)
+        self.nameIndex = fromBytes("i",data[0])
+        self.parents = fromBytes("i",data[1])
+        self.firstChild = fromBytes("i",data[2])
+        self.nextSibling = fromBytes("i",data[3])
+        self.firstTop = data[4]
+        self.ids = []
+        self.names = []
+        if self.parents:
+            self.ids = data[5].split("\x00")
+            self.names = data[6].split("\x00")
+        self.sortedIds = None
+
+
+def build(filename,token=None):
+
+    """returns a ClassificationSystem with the items of the given classification file.
+    See iterItems() about token. token.system is set to the system being read, which
+    can be shown by other threads while it grows"""
+
+    system = ClassificationSystem()
+    if token:
+        token.system = system
+    system.read(filename,token)
+    return system
+
+
+# the systems loaded in this session, least recently used first
+
+cache = OrderedDict() # name: [ClassificationSystem or None if it couldn't be read, SearchIndex or None]
+cacheLock = threading.RLock() # systems are also loaded by worker threads
+
+
+def getCacheSize():
+
+    "returns the maximum memory used by loaded systems and their indexes, in bytes"
+
+    import FreeCAD
+    return FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetInt("ClassificationCacheSize",256)*1024*1024
+
+
+def isLoaded(name):
+
+    return name in cache
+
+
+def getEntry(name):
+
+    "returns the cache entry of a loaded system, marking it as the most recently used"
+
+    with cacheLock:
+        entry = cache.pop(name)
+        cache[name] = entry
+        return entry
+
+
+def getSystem(name,token=None):
+
+    """returns the ClassificationSystem of the given name, loading it if it hasn't been
+    loaded yet, or None if there is no such system. Missing systems are not cached, so
+    presets added later are found. See iterItems() about token"""
+
+    with cacheLock:
+        if name in cache:
+            return getEntry(name)[0]
+    preset = getPresetPath(name)
+    if not preset:
+        return None
+    # loaded outside of the lock, so other systems stay available meanwhile
+    system = load(preset,token)
+    with cacheLock:
+        if not name in cache:
+            cache[name] = [system,None]
+        entry = getEntry(name)
+        release()
+        return entry[0]
+
+
+def setFailed(name):
+
+    "marks a system that couldn't be loaded, so it isn't loaded again"
+
+    with cacheLock:
+        cache[name] = [None,None]
+
+
+def getIndex(name):
+
+    "returns the SearchIndex of the given system, or None if there is no such system"
+
+    system = getSystem(name)
+    if not system:
+        return None
+    with cacheLock:
+        entry = cache.get(name)
+    if not entry:
+        return SearchIndex(system) # just released
+    if not entry[1]:
+        entry[1] = SearchIndex(system)
+        with cacheLock:
+            release()
+    return entry[1]
+
+
+def release(size=None):
+
+    """releases the least recently used systems until the loaded ones use less than the
+    given memory size, in bytes. The most recently used system is always kept"""
+
+    if size is None:
+        size = getCacheSize()
+    with cacheLock:
+        total = sum([getEntrySize(entry) for entry in cache.values()])
+        while (total > size) and (len(cache) > 1):
+            name,entry = cache.popitem(last=False)
+            total -= getEntrySize(entry)
+
+
+def getEntrySize(entry):
+
+    size = 0
+    for item in entry:
+        if item:
+            size += item.getSize()
+    return size
+
+
+def lookup(code,system=None):
+
+    """returns the (ID,Name) of the class of the given code, or None if not found. code
+    can be a StandardCode value such as "Uniclass Ss_25_10", or a code of the given system"""
+
+    if not system:
+        system,code = splitCode(code)
+    classes = getSystem(system)
+    if classes:
+        i = classes.findCode(code)
+        if i >= 0:
+            return (classes.ids[i],classes.getName(i))
+    return None
+
+
+def splitCode(value,systems=None):
+
+    """splits a StandardCode value, made of a system name and a class ID separated by
+    a space, into a (system,code) tuple. Names of the given systems, which can
+    contain spaces, are recognized first. The code keeps the class name that older
+    versions appended to the ID, see ClassificationSystem.findCode()"""
+
+    if systems is None:
+        systems = listSystems()
+    for system in sorted(systems,key=len,reverse=True):
+        if value.startswith(system+" "):
+            return system,value[len(system)+1:].strip()
+    if " " in value:
+        system,code = value.split(" ",1)
+        return system,code.strip()
+    return "",value.strip()
+
+
+def readCSV(filename):
+
+    """yields the rows of a CSV file as lists of stripped strings, skipping empty
+    lines and lines starting with #"""
+
+    import csv
+    if sys.version_info.major < 3:
+        f = open(filename,"rb")
+    else:
+        f = open(filename,"r",newline="",encoding="utf-8")
+    with f:
+        for row in csv.reader(f):
+            if sys.version_info.major < 3:
+                row = [v.decode("utf8") for v in row]
+            row = [v.strip() for v in row]
+            if row and row[0] and not row[0].startswith("#"):
+                yield row
+
+
+class Mapping:
+
+
+    """a table of equivalent codes between several classification systems. Each row
+    holds the codes of one class in each system, or an empty string"""
+
+    def __init__(self,systems=[]):
+
+        self.systems = list(systems)
+        self.rows = []
+        self.indexes = {} # system: {code: row}, built when needed
+
+    def addRow(self,codes):
+
+        self.rows.append(list(codes)+[""]*(len(self.systems)-len(codes)))
+        self.indexes = {}
+
+    def getIndex(self,system):
+
+        if not system in self.indexes:
+            col = self.systems.index(system)
+            index = {}
+            for row in self.rows:
+                if row[col] and not row[col] in index:
+                    index[row[col]] = row
+            self.indexes[system] = index
+        return self.indexes[system]
+
+    def map(self,code,source,target):
+
+        "returns the code of the target system equivalent to the given code of the source system, or None"
+
+        if (not source in self.systems) or (not target in self.systems):
+            return None
+        row = self.getIndex(source).get(code)
+        if row:
+            return row[self.systems.index(target)] or None
+        return None
+
+
+def readMapping(filename):
+
+    """returns a Mapping read from a CSV or XML file. The first row of a CSV file holds
+    the names of the systems, and each following row the codes of one class in each
+    of them. XML files are made of items like this:
+
+        <Item><Code system="Uniclass">Ss_25_10</Code><Code system="OmniClass">21-02 10 10</Code></Item>"""
+
+    if filename.lower().endswith(".csv"):
+        mapping = None
+        for row in readCSV(filename):
+            if mapping is None:
+                mapping = Mapping(row)
+            else:
+                mapping.addRow(row)
+        return mapping or Mapping()
+    # XML, read with the same expat-free approach as iterItems()
+    with openPreset(filename) as f:
+        data = f.read().decode("utf-8","replace")
+    items = []
+    item = None
+    for part in data.split("<"):
+        k = part.find(">")
+        if k < 0:
+            continue
+        tag,closing = getTag(part[:k])
+        if tag == "Item":
+            if closing:
+                item = None
+            else:
+                item = {}
+                items.append(item)
+        elif (tag == "Code") and (item is not None) and not closing:
+            attr = part[:k].find("system=")
+            if attr >= 0:
+                quote = part[attr+7:attr+8]
+                system = part[attr+8:part.find(quote,attr+8)]
+                item[system] = getText([part[k+1:]])
+    systems = []
+    for item in items:
+        for system in item:
+            if not system in systems:
+                systems.append(system)
+    mapping = Mapping(systems)
+    for item in items:
+        mapping.addRow([item.get(system,"") for system in systems])
+    return mapping
+
+
+def getCacheKey(filename):
+
+    "returns what identifies the given version of a preset file"
+
+    st = os.stat(filename)
+    return (cacheversion,tuple(sys.version_info[:2]),os.path.abspath(filename),st.st_size,st.st_mtime)
+
+
+def load(filename,token=None):
+
+    """returns a ClassificationSystem with the items of the given classification file,
+    using the cache file if it is up to date, and writing it otherwise. The arrays of
+    the system are stored as a few large strings, which are fast to load. See
+    iterItems() about token"""
+
+    key = getCacheKey(filename)
+    cache = filename+".cache"
+    if os.path.exists(cache):
+        try:
+            with open(cache,"rb") as f:
+                if marshal.load(f) == key:
+                    system = ClassificationSystem()
+                    system.load(f)
+                    return system
+        except (IOError,OSError,EOFError,ValueError,TypeError,IndexError):
+            pass # unreadable or from another version, rebuilt below
+    system = build(filename,token)
+    try:
+        # written under another name first, so an interrupted write doesn't leave a broken cache
+        with open(cache+".tmp","wb") as f:
+            marshal.dump(key,f)
+            system.dump(f)
+        if os.path.exists(cache):
+            os.remove(cache)
+        os.rename(cache+".tmp",cache)
+    except (IOError,OSError):
+        pass # the presets folder might be read-only
+    return system
+
+
+def getWords(text):
+
+    "returns the lowercase words of a text, as used by the search index"
+
+    return text.lower().translate(separators).split()
+
+
+
+class SearchIndex:
+
+
+    "a prefix index of the IDs and of the words of the IDs and Names of a ClassificationSystem"
+
+    def __init__(self,system):
+
+        self.system = system
+        ids = system.ids[:] # the system might still be growing in another thread
+        words = []
+        items = array("i")
+        table = {} # to store each distinct word once
+        for i in range(len(ids)):
+            w = [table.setdefault(word,word) for word in set(getWords(ids[i]+" "+system.getName(i)))]
+            words.extend(w)
+            items.extend([i]*len(w))
+        self.wordCount = len(table)
+        order = sorted(range(len(words)),key=words.__getitem__)
+        self.words = [words[j] for j in order]
+        self.wordItems = array("i",[items[j] for j in order])
+        codes = [ID.lower() for ID in ids]
+        order = sorted(range(len(codes)),key=codes.__getitem__)
+        self.codes = [codes[j] for j in order]
+        self.codeItems = array("i",order)
+
+    def getPrefixed(self,keys,items,prefix):
+
+        "returns the items whose key in the sorted keys list starts with prefix"
+
+        return items[bisect_left(keys,prefix):bisect_left(keys,prefix+u"\uffff")]
+
+    def find(self,text,limit=None):
+
+        """returns the positions of the items matching the given text, best first: items
+        whose ID starts with the text, then items that have a word starting with each
+        word of the text"""
+
+        text = text.strip().lower()
+        words = getWords(text)
+        if not words:
+            return []
+        found = set(self.getPrefixed(self.codes,self.codeItems,text))
+        # start with the rarest word, and check the most common ones on the few remaining items
+        ranges = []
+        for word in set(words):
+            lo = bisect_left(self.words,word)
+            hi = bisect_left(self.words,word+u"\uffff")
+            ranges.append((hi-lo,lo,hi,word))
+        ranges.sort()
+        matches = set(self.wordItems[ranges[0][1]:ranges[0][2]])
+        for size,lo,hi,word in ranges[1:]:
+            if not matches:
+                break
+            if size > 4*len(matches):
+                matches = set([i for i in matches if self.hasWord(i,word)])
+            else:
+                matches &= set(self.wordItems[lo:hi])
+        found.update(matches)
+        if limit:
+            return nsmallest(limit,found,key=lambda i: self.getRank(i,text))
+        return sorted(found,key=lambda i: self.getRank(i,text))
+
+    def findPartial(self,text,limit=None):
+
+        """returns (position,share) tuples of the items that have a word starting with some
+        of the words of the given text, best first, share being the part of the words of
+        the text they match. Used when find() gives nothing, as it needs all the words"""
+
+        text = text.strip().lower()
+        words = set(getWords(text))
+        if not words:
+            return []
+        counts = {} # item: number of matched words
+        for word in words:
+            for i in set(self.getPrefixed(self.words,self.wordItems,word)):
+                counts[i] = counts.get(i,0)+1
+        key = lambda i: (-counts[i],self.getRank(i,text))
+        if limit:
+            found = nsmallest(limit,counts,key=key)
+        else:
+            found = sorted(counts,key=key)
+        return [(i,float(counts[i])/len(words)) for i in found]
+
+    def getSize(self):
+
+        "returns an estimate of the memory used by this index, in bytes"
+
+        return 12*(len(self.words)+len(self.codes))+60*(self.wordCount+len(self.codes))+sum(map(len,self.codes))
+
+    def hasWord(self,i,prefix):
+
+        for word in getWords(self.system.ids[i]+" "+self.system.getName(i)):
+            if word.startswith(prefix):
+                return True
+        return False
+
+    def getRank(self,i,text):
+
+        ID = self.system.ids[i].lower()
+        name = self.system.getName(i).lower()
+        if ID == text:
+            rank = 0
+        elif ID.startswith(text):
+            rank = 1
+        elif name == text:
+            rank = 2
+        elif name.startswith(text):
+            rank = 3
+        else:
+            rank = 4
+        return (rank,len(ID),ID)
@@ -29,7 +29,7 @@ def QT_TRANSLATE_NOOP(ctx,txt): return txt # dummy function for the QT translato
 
 # import commands that are defined in their separate files
 
-import BimWelcome,BimSetup,BimProject,BimLevels,BimWindows,BimIfcElements,BimViews,BimClassification,BimBox,BimTutorial
+import BimWelcome,BimSetup,BimProject,BimLevels,BimWindows,BimIfcElements,BimViews,BimClassification,BimBox,BimTutorial,BimIndex
 
 
 # additional, smaller commands that are defined directly in this file
@@ -130,13 +130,24 @@ class BimDocumentObserver:
     
     def __init__(self):
 
+        # indexes built before this observer was running may be outdated
+        BimIndex.clear()
         import AddonManager
         self.check_worker = AddonManager.CheckWBWorker([["BIM","https://github.com/yorikvanhavre/BIM_Workbench",1]])
         self.check_worker.mark.connect(self.slotUpdateAvailable)
         self.check_worker.start()
 
+    def slotCreatedObject(self,obj):
+
+        BimIndex.onCreated(obj)
+
+    def slotDeletedObject(self,obj):
+
+        BimIndex.onDeleted(obj)
+
     def slotChangedObject(self,obj,prop):
 
+        BimIndex.onChanged(obj,prop)
         BimViews.update()
         BimTutorial.update()
 
@@ -155,7 +166,16 @@ class BimDocumentObserver:
 
     def slotDeletedDocument(self,doc):
 
-        pass
+        BimIndex.clear(doc)
+        BimIfcElements.clearCache(doc)
+
+    def slotUndoDocument(self,doc):
+
+        BimIndex.clear(doc)
+
+    def slotRedoDocument(self,doc):
+
+        BimIndex.clear(doc)
 
     def slotUpdateAvailable(self,txt):
 
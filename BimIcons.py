@@ -0,0 +1,65 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+"""This module contains a registry of the icons used in the lists of the BIM
+dialogs. Each icon is looked up and rasterized only once, then the same QIcon is
+shared by all the rows and dialogs that use it."""
+
+from PySide import QtCore,QtGui
+
+icons = {} # (path,size): QIcon
+typeIcons = {} # (Arch type,size): QIcon
+
+
+def getIconSize():
+
+    "returns the size of the icons of item views"
+
+    return QtGui.QApplication.style().pixelMetric(QtGui.QStyle.PM_SmallIconSize)
+
+
+def getIcon(path,size=None):
+
+    """returns a shared icon from the given file or resource path, rasterized at the
+    given size (the default item views icon size if None)"""
+
+    if not size:
+        size = getIconSize()
+    if not (path,size) in icons:
+        pixmap = QtGui.QIcon(path).pixmap(size,size)
+        icons[(path,size)] = QtGui.QIcon(pixmap)
+    return icons[(path,size)]
+
+
+def getTypeIcon(typename,size=None):
+
+    "returns the shared tree icon of the given Arch type, or the generic component icon"
+
+    if not size:
+        size = getIconSize()
+    if not (typename,size) in typeIcons:
+        path = ":/icons/Arch_"+typename+"_Tree.svg"
+        if not QtCore.QFileInfo(path).exists():
+            path = ":/icons/Arch_Component.svg"
+        typeIcons[(typename,size)] = getIcon(path,size)
+    return typeIcons[(typename,size)]
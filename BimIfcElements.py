@@ -24,17 +24,35 @@
 
 """This module contains FreeCAD commands for the BIM workbench"""
 
-import os,FreeCAD,FreeCADGui,Arch_rc
+import os,FreeCAD,FreeCADGui,Arch_rc,BimTakeoff,BimIndex,BimIcons,BimModels
+from array import array
 from PySide import QtCore,QtGui
 
 
 def QT_TRANSLATE_NOOP(ctx,txt): return txt # dummy function for the QT translator
 
-qprops = ["Length","Width","Height","Area","HorizontalArea","VerticalArea","Volume"]
+qprops = BimTakeoff.qprops
+qunits = BimTakeoff.qunits
+quantityCache = {} # (document name, object name): (fingerprint, volume)
+
+# QSortFilterProxyModel and QStringListModel moved from QtGui to QtCore in Qt5
+if hasattr(QtCore,"QSortFilterProxyModel"):
+    QSortFilterProxyModel = QtCore.QSortFilterProxyModel
+else:
+    QSortFilterProxyModel = QtGui.QSortFilterProxyModel
+if hasattr(QtCore,"QStringListModel"):
+    QStringListModel = QtCore.QStringListModel
+else:
+    QStringListModel = QtGui.QStringListModel
+
+
 
 class BIM_IfcElements:
 
 
+    # maximum time spent computing volumes between two GUI events, in seconds
+    interval = 0.05
+
     def GetResources(self):
 
         return {'Pixmap'  : os.path.join(os.path.dirname(__file__),"icons","BIM_IfcElements.svg"),
@@ -53,48 +71,65 @@ class BIM_IfcElements:
 
     def Activated(self):
 
-        # build objects list
-        self.objectslist = {}
-        for obj in FreeCAD.ActiveDocument.Objects:
-            if hasattr(obj,"IfcRole"):
-                mat = ""
-                if hasattr(obj,"Material") and obj.Material:
-                    mat = obj.Material.Name
-                self.objectslist[obj.Name] = [obj.IfcRole,mat]
         import ArchComponent
         self.ifcroles = ArchComponent.IfcRoles
 
+        # build objects store
+        self.store = IfcElementsStore(self.ifcroles)
+        for obj in BimIndex.getObjects(role=True):
+            self.store.add(obj)
+
         # load the form and set the tree model up
         self.form = FreeCADGui.PySideUic.loadUi(os.path.join(os.path.dirname(__file__),"dialogIfcElements.ui"))
         self.form.setWindowIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","BIM_IfcElements.svg")))
-        self.model = QtGui.QStandardItemModel()
-        self.form.tree.setModel(self.model)
+        self.model = IfcElementsModel(self.store)
+        self.proxy = IfcElementsFilter(self.model)
+        self.matFilter = None # the name of the material shown by the material filter
+        self.form.tree.setModel(self.proxy)
+        self.form.tree.setSortingEnabled(True)
+        self.form.tree.sortByColumn(0,QtCore.Qt.AscendingOrder)
         self.form.tree.setUniformRowHeights(True)
+        self.choices = IfcElementsChoices(self.ifcroles)
         self.form.tree.setItemDelegate(IfcElementsDelegate(dialog=self))
-        self.form.globalMode.addItems([" "]+self.ifcroles)
+        self.form.globalMode.setModel(self.choices.roles)
         self.form.groupMode.setItemIcon(2,QtGui.QIcon(":/icons/Arch_Material.svg"))
         self.form.groupMode.setItemIcon(3,QtGui.QIcon(":/icons/Document.svg"))
         self.form.buttonEdit.setIcon(QtGui.QIcon(":/icons/IFC.svg"))
-        self.form.globalMaterial.addItem(" ")
-        self.materials = []
-        for o in FreeCAD.ActiveDocument.Objects:
-            if o.isDerivedFrom("App::MaterialObject"):
-                self.materials.append(o.Name)
-                self.form.globalMaterial.addItem(o.Label)
+        self.form.globalMaterial.setModel(self.choices.materials)
+        self.form.filterRole.setModel(self.choices.roles)
+        self.form.filterMaterial.setModel(self.choices.materials)
         QtCore.QObject.connect(self.form.groupMode, QtCore.SIGNAL("currentIndexChanged(int)"), self.update)
         QtCore.QObject.connect(self.form.tree, QtCore.SIGNAL("clicked(QModelIndex)"), self.setGlobalMode)
-        QtCore.QObject.connect(self.form.onlyVisible, QtCore.SIGNAL("stateChanged(int)"), self.update)
+        QtCore.QObject.connect(self.form.onlyVisible, QtCore.SIGNAL("stateChanged(int)"), self.setOnlyVisible)
+        QtCore.QObject.connect(self.form.search, QtCore.SIGNAL("textChanged(QString)"), self.proxy.setText)
+        QtCore.QObject.connect(self.form.filterRole, QtCore.SIGNAL("currentIndexChanged(int)"), self.setRoleFilter)
+        QtCore.QObject.connect(self.form.filterMaterial, QtCore.SIGNAL("currentIndexChanged(int)"), self.setMaterialFilter)
         QtCore.QObject.connect(self.form.buttonBox, QtCore.SIGNAL("accepted()"), self.accept)
+        QtCore.QObject.connect(self.form, QtCore.SIGNAL("rejected()"), self.reject)
         QtCore.QObject.connect(self.form.globalMode, QtCore.SIGNAL("currentIndexChanged(int)"), self.getGlobalMode)
         QtCore.QObject.connect(self.form.globalMaterial, QtCore.SIGNAL("currentIndexChanged(int)"), self.getGlobalMaterial)
         QtCore.QObject.connect(self.form.buttonEdit, QtCore.SIGNAL("clicked()"), self.editProperties)
+        QtCore.QObject.connect(self.proxy, QtCore.SIGNAL("rowsInserted(QModelIndex,int,int)"), self.expandRows)
+
+        # visibility and material changes are followed while the dialog is open
+        self.filterTimer = QtCore.QTimer()
+        self.filterTimer.setSingleShot(True)
+        self.filterTimer.setInterval(100)
+        QtCore.QObject.connect(self.filterTimer, QtCore.SIGNAL("timeout()"), self.proxy.refresh)
+        self.observer = IfcElementsObserver(self)
+        FreeCAD.addDocumentObserver(self.observer)
 
         # quantities tab
-        self.qmodel = QtGui.QStandardItemModel()
+        self.qmodel = IfcQuantitiesModel(self.store)
         self.form.quantities.setModel(self.qmodel)
         self.form.quantities.setUniformRowHeights(True)
         self.form.quantities.setItemDelegate(QtGui.QStyledItemDelegate())
         self.quantitiesDrawn = False
+        self.jobs = [] # (row,shape,fingerprint) tuples whose volume is still to compute, last first
+        self.volumeTimer = QtCore.QTimer()
+        self.volumeTimer.setInterval(0)
+        QtCore.QObject.connect(self.volumeTimer, QtCore.SIGNAL("timeout()"), self.computeVolumes)
+        self.docname = FreeCAD.ActiveDocument.Name
         QtCore.QObject.connect(self.qmodel, QtCore.SIGNAL("dataChanged(QModelIndex,QModelIndex)"), self.setChecked)
 
         # center the dialog over FreeCAD window
@@ -104,296 +139,200 @@ class BIM_IfcElements:
         self.update()
         self.form.show()
 
+    def computeVolumes(self):
+
+        # volumes are computed on the GUI thread, a few at a time between two events:
+        # shapes don't release the Python lock while computing their volume, so a worker
+        # thread would freeze the GUI as well. A single very heavy shape still blocks the
+        # GUI while its own volume is computed
+        import time
+        start = time.time()
+        results = []
+        while self.jobs and (time.time()-start < self.interval):
+            row,shape,fingerprint = self.jobs.pop()
+            try:
+                volume = shape.Volume
+            except Exception:
+                volume = float("nan")
+            results.append((row,volume,fingerprint))
+        if results:
+            self.setVolumes(results)
+        if not self.jobs:
+            self.volumeTimer.stop()
+
+    def setVolumes(self,results):
+
+        "stores a chunk of computed (row,volume,fingerprint) results"
+
+        for row,volume,fingerprint in results:
+            self.store.quantities["Volume"][row] = volume
+            quantityCache[(self.docname,self.store.names[row])] = (fingerprint,volume)
+        self.qmodel.setComputed([result[0] for result in results])
+
+    def stopWorker(self):
+
+        self.volumeTimer.stop()
+        self.jobs = []
+
+    def close(self):
+
+        "stops the background tasks of the dialog"
+
+        self.stopWorker()
+        if self.observer:
+            FreeCAD.removeDocumentObserver(self.observer)
+            self.observer = None
+
+    def reject(self):
+
+        self.close()
+
+    def setOnlyVisible(self,state):
+
+        self.proxy.setOnlyVisible(bool(state))
+
+    def setRoleFilter(self,i):
+
+        # the empty choice shows all roles
+        if i > 0:
+            self.proxy.setRoles([self.store.internRole(self.choices.rolenames[i])])
+        else:
+            self.proxy.setRoles(None)
+
+    def setMaterialFilter(self,i):
+
+        # the empty choice shows all materials
+        if i > 0:
+            self.matFilter = self.choices.matnames[i]
+        else:
+            self.matFilter = None
+        self.updateMaterialFilter()
+
+    def updateMaterialFilter(self):
+
+        "applies the material filter, again when its material gets used by an object for the first time"
+
+        if self.matFilter:
+            # materials no object uses yet aren't in the store, and match nothing
+            self.proxy.setMaterials([self.store.matindex.get(self.matFilter,-2)])
+        else:
+            self.proxy.setMaterials(None)
+
+    def internMaterial(self,obj):
+
+        "returns the store index of the given material object, adding it to the store if needed"
+
+        n = len(self.store.matnames)
+        mat = self.store.internMaterial(obj)
+        if (len(self.store.matnames) > n) and (obj.Name == self.matFilter):
+            self.updateMaterialFilter()
+        return mat
+
+    def setVisibility(self,obj):
+
+        "called by the observer when the visibility of an object changes"
+
+        row = self.store.index.get(obj.Name)
+        if row != None:
+            self.store.visible[row] = bool(obj.Visibility)
+            if self.proxy.onlyVisible:
+                self.filterTimer.start()
+
+    def addMaterial(self,obj):
+
+        self.choices.addMaterial(obj)
+
+    def removeMaterial(self,obj):
+
+        # removing a row above the current one would change the current index and assign
+        self.form.globalMaterial.blockSignals(True)
+        self.choices.removeMaterial(obj.Name)
+        self.form.globalMaterial.blockSignals(False)
+
+    def renameMaterial(self,obj):
+
+        self.choices.renameMaterial(obj)
+        mat = self.store.renameMaterial(obj)
+        if mat >= 0:
+            self.model.materialChanged(mat)
+
     def update(self,index=None):
 
-        import Draft
-
-        # store current state of tree into self.objectslist before redrawing
-        for row in range(self.model.rowCount()):
-            name = self.model.item(row,0).toolTip()
-            mat = self.model.item(row,2).toolTip()
-            if name:
-                self.objectslist[name] = [self.model.item(row,1).text(),mat]
-            if self.model.item(row,0).hasChildren():
-                for childrow in range(self.model.item(row,0).rowCount()):
-                    name = self.model.item(row,0).child(childrow,0).toolTip()
-                    mat = self.model.item(row,0).child(childrow,2).toolTip()
-                    if name:
-                        self.objectslist[name] = [self.model.item(row,0).child(childrow,1).text(),mat]
-        self.model.clear()
-        self.model.setHorizontalHeaderLabels(["Label","IFC type","Material"])
-        #self.form.tree.header().setResizeMode(QtGui.QHeaderView.Stretch)
-        #self.form.tree.resizeColumnsToContents()
-
-        # quantities tab - only fill once
-        if not self.quantitiesDrawn:
-            self.qmodel.setHorizontalHeaderLabels(["Label","Length","Width","Height","Area","Horiz Area","Vert Area","Volume"])
+        "rebuilds the structure of the tree. Only needed when the grouping changes, filters are applied by self.proxy"
 
+        # quantities tab - only fill once. The other quantities are cheap to read, but the
+        # cached volume is used if the shape didn't change since last time, otherwise
+        # volumes are computed in the background by computeVolumes()
+        if not self.quantitiesDrawn:
+            rows = []
+            jobs = []
+            for row,name in enumerate(self.store.names):
+                obj = FreeCAD.ActiveDocument.getObject(name)
+                if obj and ((not self.form.onlyVisible.isChecked()) or self.store.visible[row]):
+                    if BimTakeoff.isQuantifiable(obj):
+                        fingerprint = getFingerprint(obj)
+                        cached = quantityCache.get((FreeCAD.ActiveDocument.Name,name))
+                        shape = self.store.readQuantities(row,obj)
+                        if cached and (cached[0] == fingerprint):
+                            self.store.quantities["Volume"][row] = cached[1]
+                        elif shape:
+                            jobs.append((row,shape,fingerprint))
+                        self.store.readExports(row,obj)
+                        rows.append(row)
             # sort by type
-            groups = {}
-            for name,rolemat in self.objectslist.items():
-                role = rolemat[0]
-                groups.setdefault(role,[]).append(name)
-            for names in groups.values():
-                for name in names:
-                    obj = FreeCAD.ActiveDocument.getObject(name)
-                    if obj:
-                        if (not self.form.onlyVisible.isChecked()) or obj.ViewObject.isVisible():
-                            if obj.isDerivedFrom("Part::Feature") and not (Draft.getType(obj) == "Site"):
-                                it1 = QtGui.QStandardItem(obj.Label)
-                                it1.setToolTip(name)
-                                it1.setEditable(False)
-                                if QtCore.QFileInfo(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg").exists():
-                                    icon = QtGui.QIcon(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg")
-                                else:
-                                    icon = QtGui.QIcon(":/icons/Arch_Component.svg")
-                                it1.setIcon(icon)
-                                props = []
-                                for prop in qprops:
-                                    it = QtGui.QStandardItem()
-                                    val = None
-                                    if prop == "Volume":
-                                        if obj.Shape and hasattr(obj.Shape,"Volume"):
-                                            val = FreeCAD.Units.Quantity(obj.Shape.Volume,FreeCAD.Units.Volume)
-                                            it.setText(val.getUserPreferred()[0].replace(u"^3",u"³"))
-                                            it.setCheckable(True)
-                                    else:
-                                        if hasattr(obj,prop) and (not "Hidden" in obj.getEditorMode(prop)):
-                                            val = getattr(obj,prop)
-                                            it.setText(val.getUserPreferred()[0].replace(u"^2",u"²"))
-                                            it.setCheckable(True)
-                                    if val != None:
-                                        if hasattr(obj,"IfcAttributes") and ("Export"+prop in obj.IfcAttributes) and obj.IfcAttributes["Export"+prop]:
-                                            it.setCheckState(True)
-                                        if val == 0:
-                                            it.setIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","warning.svg")))
-                                    if prop in ["Area","HorizontalArea","VerticalArea","Volume"]:
-                                        it.setEditable(False)
-                                    props.append(it)
-                                self.qmodel.appendRow([it1]+props)
+            rows.sort(key=lambda row: self.store.roles[row])
+            self.qmodel.setRows(rows)
             self.quantitiesDrawn = True
+            if jobs:
+                self.qmodel.pending = set([job[0] for job in jobs])
+                jobs.reverse()
+                self.jobs = jobs
+                self.volumeTimer.start()
 
-        if self.form.groupMode.currentIndex() == 1: # group by type
+        rows = [row for row,name in enumerate(self.store.names) if FreeCAD.ActiveDocument.getObject(name)]
 
-            groups = {}
-            for name,rolemat in self.objectslist.items():
-                role = rolemat[0]
-                mat = rolemat[1]
-                obj = FreeCAD.ActiveDocument.getObject(name)
-                if obj:
-                    if (not self.form.onlyVisible.isChecked()) or obj.ViewObject.isVisible():
-                        groups.setdefault(role,[]).append([name,mat])
-
-            for group in groups.keys():
-                s1 = group + " ("+str(len(groups[group]))+")"
-                top = QtGui.QStandardItem(s1)
-                self.model.appendRow([top,QtGui.QStandardItem(),QtGui.QStandardItem()])
-                for name,mat in groups[group]:
-                    obj = FreeCAD.ActiveDocument.getObject(name)
-                    if obj:
-                        it1 = QtGui.QStandardItem(obj.Label)
-                        if QtCore.QFileInfo(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg").exists():
-                            icon = QtGui.QIcon(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg")
-                        else:
-                            icon = QtGui.QIcon(":/icons/Arch_Component.svg")
-                        it1.setIcon(icon)
-                        it1.setToolTip(obj.Name)
-                        it2 = QtGui.QStandardItem(group)
-                        if group != obj.IfcRole:
-                            it2.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                        matlabel = ""
-                        if mat:
-                            matobj = FreeCAD.ActiveDocument.getObject(mat)
-                            if matobj:
-                                matlabel = matobj.Label
-                        it3 = QtGui.QStandardItem(matlabel)
-                        it3.setToolTip(mat)
-                        omat = ""
-                        if hasattr(obj,"Material") and obj.Material:
-                            omat = obj.Material.Name
-                            if omat != mat:
-                                it3.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                        top.appendRow([it1,it2,it3])
-                top.sortChildren(0)
-            self.form.tree.expandAll()
-
-            # span top levels
-            if self.form.groupMode.currentIndex() in [1,2]:
-                idx = self.model.invisibleRootItem().index()
-                for i in range(self.model.rowCount()):
-                    if self.model.item(i,0).hasChildren():
-                        self.form.tree.setFirstColumnSpanned(i, idx, True)
-
-        elif self.form.groupMode.currentIndex() == 2: # group by material
-
-            groups = {}
-            for name,rolemat in self.objectslist.items():
-                role = rolemat[0]
-                mat = rolemat[1]
-                if not mat:
-                    mat = "Undefined"
-                obj = FreeCAD.ActiveDocument.getObject(name)
-                if obj:
-                    if (not self.form.onlyVisible.isChecked()) or obj.ViewObject.isVisible():
-                        groups.setdefault(mat,[]).append([name,role])
-
-            for group in groups.keys():
-                grlabel = "Undefined"
-                if group != "Undefined":
-                    matobj = FreeCAD.ActiveDocument.getObject(group)
-                    if matobj:
-                        grlabel = matobj.Label
-                s1 = grlabel + " ("+str(len(groups[group]))+")"
-                top = QtGui.QStandardItem(s1)
-                self.model.appendRow([top,QtGui.QStandardItem(),QtGui.QStandardItem()])
-                for name,role in groups[group]:
-                    obj = FreeCAD.ActiveDocument.getObject(name)
-                    if obj:
-                        it1 = QtGui.QStandardItem(obj.Label)
-                        if QtCore.QFileInfo(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg").exists():
-                            icon = QtGui.QIcon(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg")
-                        else:
-                            icon = QtGui.QIcon(":/icons/Arch_Component.svg")
-                        it1.setIcon(icon)
-                        it1.setToolTip(obj.Name)
-                        it2 = QtGui.QStandardItem(role)
-                        if role != obj.IfcRole:
-                            it2.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                        mat = ""
-                        matlabel = ""
-                        if group != "Undefined":
-                            matobj = FreeCAD.ActiveDocument.getObject(group)
-                            if matobj:
-                                matlabel = matobj.Label
-                                mat = matobj.Name
-                        it3 = QtGui.QStandardItem(matlabel)
-                        it3.setToolTip(mat)
-                        omat = ""
-                        if hasattr(obj,"Material") and obj.Material:
-                            omat = obj.Material.Name
-                            if omat != mat:
-                                it3.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                        top.appendRow([it1,it2,it3])
-                top.sortChildren(0)
-            self.form.tree.expandAll()
-
-            # span top levels
-            if self.form.groupMode.currentIndex() in [1,2]:
-                idx = self.model.invisibleRootItem().index()
-                for i in range(self.model.rowCount()):
-                    if self.model.item(i,0).hasChildren():
-                        self.form.tree.setFirstColumnSpanned(i, idx, True)
-
-        elif self.form.groupMode.currentIndex() == 3: # group by model structure
-
-            # order by hierarchy
-            def istop(obj):
-                for parent in obj.InList:
-                    if parent.Name in self.objectslist.keys():
-                        return False
-                return True
-
-            rel = []
-            deps = []
-            for name in self.objectslist.keys():
-                obj = FreeCAD.ActiveDocument.getObject(name)
-                if obj:
-                    if istop(obj):
-                        rel.append(obj)
-                    else:
-                        deps.append(obj)
-            pa = 1
-            while deps:
-                for obj in rel:
-                    for child in obj.OutList:
-                        if child in deps:
-                            rel.append(child)
-                            deps.remove(child)
-                pa += 1
-                if pa == 10: # max 10 hierarchy levels, okay? Let's keep civilised
-                    rel.extend(deps)
-                    break
-
-            #print "rel:",[o.Label for o in rel]
-
-            done = {}
-            for obj in rel:
-                rolemat = self.objectslist[obj.Name]
-                role = rolemat[0]
-                mat = rolemat[1]
-
-                if (not self.form.onlyVisible.isChecked()) or obj.ViewObject.isVisible():
-                    it1 = QtGui.QStandardItem(obj.Label)
-                    if QtCore.QFileInfo(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg").exists():
-                        icon = QtGui.QIcon(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg")
-                    else:
-                        icon = QtGui.QIcon(":/icons/Arch_Component.svg")
-                    it1.setIcon(icon)
-                    it1.setToolTip(obj.Name)
-                    it2 = QtGui.QStandardItem(role)
-                    if role != obj.IfcRole:
-                        it2.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                    matlabel = ""
-                    if mat:
-                        matobj = FreeCAD.ActiveDocument.getObject(mat)
-                        if matobj:
-                            matlabel = matobj.Label
-                    else:
-                        mat = ""
-                    it3 = QtGui.QStandardItem(matlabel)
-                    it3.setToolTip(mat)
-                    omat = ""
-                    if hasattr(obj,"Material") and obj.Material:
-                        omat = obj.Material.Name
-                        if omat != mat:
-                            it3.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                    ok = False
-                    for par in obj.InList:
-                        if par.Name in done:
-                            done[par.Name].appendRow([it1,it2,it3])
-                            done[obj.Name] = it1
-                            ok = True
-                            break
-                    if not ok:
-                        self.model.appendRow([it1,it2,it3])
-                        done[obj.Name] = it1
-            self.form.tree.expandAll()
+        if self.form.groupMode.currentIndex() == 3: # group by model structure
 
-        else: # alphabetic order
+            objs = [FreeCAD.ActiveDocument.getObject(self.store.names[row]) for row in rows]
+            hierarchy,cycles = getHierarchy(objs)
+            if cycles:
+                FreeCAD.Console.PrintWarning("Circular dependency found in the model structure: "+", ".join(cycles)+"\n")
+            hierarchy = [(self.store.index[name],self.store.index.get(parent,-1)) for name,parent in hierarchy]
+            self.model.build(hierarchy,3)
 
-            for name,rolemat in self.objectslist.items():
-                role = rolemat[0]
-                mat = rolemat[1]
-                obj = FreeCAD.ActiveDocument.getObject(name)
-                if obj:
-                    if (not self.form.onlyVisible.isChecked()) or obj.ViewObject.isVisible():
-                        it1 = QtGui.QStandardItem(obj.Label)
-                        if QtCore.QFileInfo(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg").exists():
-                            icon = QtGui.QIcon(":/icons/Arch_"+obj.Proxy.Type+"_Tree.svg")
-                        else:
-                            icon = QtGui.QIcon(":/icons/Arch_Component.svg")
-                        it1.setIcon(icon)
-                        it1.setToolTip(obj.Name)
-                        it2 = QtGui.QStandardItem(role)
-                        if role != obj.IfcRole:
-                            it2.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                        matlabel = ""
-                        if mat:
-                            matobj = FreeCAD.ActiveDocument.getObject(mat)
-                            if matobj:
-                                matlabel = matobj.Label
-                        else:
-                            mat = ""
-                        it3 = QtGui.QStandardItem(matlabel)
-                        it3.setToolTip(mat)
-                        omat = ""
-                        if hasattr(obj,"Material") and obj.Material:
-                            omat = obj.Material.Name
-                            if omat != mat:
-                                it3.setIcon(QtGui.QIcon(":/icons/edit-edit.svg"))
-                        self.model.appendRow([it1,it2,it3])
-
-        self.model.sort(0)
+        else: # alphabetic order, or grouped by type or material
+
+            self.model.build([(row,-1) for row in rows],self.form.groupMode.currentIndex())
+
+    def expandRows(self,parent,first,last):
+
+        "expands and spans the rows as they get fetched by the tree"
+
+        for i in range(first,last+1):
+            index = self.proxy.index(i,0,parent)
+            if self.proxy.hasChildren(index):
+                if self.model.isGroup(self.proxy.mapToSource(index)):
+                    self.form.tree.setFirstColumnSpanned(i,parent,True)
+                self.form.tree.expand(index)
+
+    def setRole(self,name,role):
+
+        "changes the IFC role of an object in the edit list, and only updates its row"
+
+        row = self.store.index.get(name)
+        if row is None:
+            return False
+        return self.model.setRole(row,self.store.internRole(role))
+
+    def setMaterial(self,name,mat):
+
+        "changes the material of an object in the edit list, and only updates its row"
+
+        row = self.store.index.get(name)
+        matobj = FreeCAD.ActiveDocument.getObject(mat)
+        if (row is None) or (not matobj):
+            return False
+        return self.model.setMaterial(row,self.internMaterial(matobj))
 
     def setGlobalMode(self,index=None):
 
@@ -403,7 +342,7 @@ class BIM_IfcElements:
         mat = None
         for index in sel:
             if index.column() == 0:
-                obj = FreeCAD.ActiveDocument.getObject(self.model.itemFromIndex(index).toolTip())
+                obj = FreeCAD.ActiveDocument.getObject(self.model.getName(self.proxy.mapToSource(index)))
                 if obj:
                     FreeCADGui.Selection.addSelection(obj)
         for index in sel:
@@ -417,20 +356,16 @@ class BIM_IfcElements:
                         mode = index.data()
         for index in sel:
             if index.column() == 2:
-                item = self.model.itemFromIndex(index)
-                m = FreeCAD.ActiveDocument.getObject(item.toolTip())
+                m = FreeCAD.ActiveDocument.getObject(index.data(QtCore.Qt.ToolTipRole) or "")
                 if mat:
                     if m != mat:
                         mat = None
                         break
                 else:
                     mat = m
-        if mode:
-            self.form.globalMode.setCurrentIndex(self.ifcroles.index(mode)+1)
-        else:
-            self.form.globalMode.setCurrentIndex(0)
+        self.form.globalMode.setCurrentIndex(self.choices.roleindex.get(mode,0))
         if mat:
-            self.form.globalMaterial.setCurrentIndex(self.materials.index(mat.Name)+1)
+            self.form.globalMaterial.setCurrentIndex(self.choices.matindex.get(mat.Name,0))
         else:
             self.form.globalMaterial.setCurrentIndex(0)
         if len(sel) > 3:
@@ -438,122 +373,99 @@ class BIM_IfcElements:
         else:
             self.form.buttonEdit.setEnabled(True)
 
+    def getSelectedNames(self):
+
+        "returns the names of the objects currently selected in the tree"
+
+        names = []
+        for index in self.form.tree.selectedIndexes():
+            if index.column() == 0:
+                name = self.model.getName(self.proxy.mapToSource(index))
+                if name:
+                    names.append(name)
+        return names
+
     def getGlobalMode(self,index=-1):
 
-        changed = False
         if index >= 1:
-            role = self.ifcroles[index-1]
-            sel = self.form.tree.selectedIndexes()
-            for index in sel:
-                if index.column() == 1:
-                    if role:
-                        if index.data() != role:
-                            self.model.setData(index, role)
-                            changed = True
-        if changed:
-            self.update()
+            role = self.choices.rolenames[index]
+            if role:
+                self.assign(self.getSelectedNames(),role=role)
 
     def getGlobalMaterial(self,index=-1):
 
-        changed = False
         if index >= 1:
-            mat = self.materials[index-1]
-            sel = self.form.tree.selectedIndexes()
-            for index in sel:
-                if index.column() == 2:
-                    if mat:
-                        mobj = FreeCAD.ActiveDocument.getObject(mat)
-                        if mobj:
-                            item = self.model.itemFromIndex(index)
-                            if item.toolTip() != mat:
-                                item.setText(mobj.Label)
-                                item.setToolTip(mat)
-                                changed = True
-        if changed:
-            self.update()
+            mat = self.choices.matnames[index]
+            if mat and FreeCAD.ActiveDocument.getObject(mat):
+                self.assign(self.getSelectedNames(),material=mat)
+
+    def assign(self,names,role=None,material=None,exports=None):
+
+        """assigns an IFC role, a material name and/or export flags (a {qprop:bool}
+        dictionary) to the given objects in the edit list, in one pass. The changes are
+        applied to the document when the dialog is accepted"""
+
+        rows = [self.store.index[name] for name in names if name in self.store.index]
+        r = None
+        if role != None:
+            r = self.store.internRole(role)
+        m = None
+        if material:
+            matobj = FreeCAD.ActiveDocument.getObject(material)
+            if matobj:
+                m = self.internMaterial(matobj)
+        changed = self.model.assign(rows,r,m)
+        if exports:
+            for prop,state in exports.items():
+                if self.qmodel.setExports(rows,qprops.index(prop),state):
+                    changed = True
+        return changed
 
     def accept(self):
 
-        # get current state of tree
+        # only the rows edited in this session are written back, in one transaction
 
         self.form.hide()
-        for row in range(self.model.rowCount()):
-            name = self.model.item(row,0).toolTip()
-            mat = self.model.item(row,2).toolTip()
-            if name:
-                self.objectslist[name] = [self.model.item(row,1).text(),mat]
-            if self.model.item(row,0).hasChildren():
-                for childrow in range(self.model.item(row,0).rowCount()):
-                    name = self.model.item(row,0).child(childrow,0).toolTip()
-                    mat = self.model.item(row,0).child(childrow,2).toolTip()
-                    if name:
-                        self.objectslist[name] = [self.model.item(row,0).child(childrow,1).text(),mat]
-        changed = False
-        for name,rolemat in self.objectslist.items():
-            role = rolemat[0]
-            mat = rolemat[1]
-            obj = FreeCAD.ActiveDocument.getObject(name)
-            if obj:
-                if obj.IfcRole != role:
-                    if not changed:
-                        FreeCAD.ActiveDocument.openTransaction("Change IFC role")
-                        changed = True
-                    obj.IfcRole = role
-                if mat and hasattr(obj,"Material"):
-                    mobj = FreeCAD.ActiveDocument.getObject(mat)
-                    if mobj:
-                        if obj.Material:
-                            if (obj.Material.Name != mat):
-                                if not changed:
-                                    FreeCAD.ActiveDocument.openTransaction("Change material")
-                                    changed = True
-                                obj.Material = mobj
-                        else:
-                            if not changed:
-                                FreeCAD.ActiveDocument.openTransaction("Change material")
-                                changed = True
-                            obj.Material = mobj
-
-        # quantities
-
-        for row in range(self.qmodel.rowCount()):
-            name = self.qmodel.item(row,0).toolTip()
-            obj = FreeCAD.ActiveDocument.getObject(name)
-            if obj:
-                for i in range(0,6):
-                    item = self.qmodel.item(row,i+1)
-                    val = item.text()
-                    sav = bool(item.checkState())
-                    if i < 3:
-                        if hasattr(obj,qprops[i]):
-                            if getattr(obj,qprops[i]).getUserPreferred()[0] != val:
-                                setattr(obj,qprops[i],val)
-                                changed = True
-                    if sav:
-                        if hasattr(obj,"IfcAttributes"):
-                            if (not "Export"+qprops[i] in obj.IfcAttributes) or (obj.IfcAttributes["Export"+qprops[i]] != sav):
-                                d = obj.IfcAttributes
-                                d["Export"+qprops[i]] = "True"
-                                obj.IfcAttributes = d
-                                changed = True
-                    else:
-                        if hasattr(obj,"IfcAttributes"):
-                            if ("Export"+qprops[i] in obj.IfcAttributes):
-                                if obj.IfcAttributes["Export"+qprops[i]] != sav:
-                                    d = obj.IfcAttributes
-                                    d["Export"+qprops[i]] = "False"
-                                    obj.IfcAttributes = d
-                                    changed = True
-
-        if changed:
-            FreeCAD.ActiveDocument.commitTransaction()
-            FreeCAD.ActiveDocument.recompute()
+        self.close()
+        store = self.store
+        doc = FreeCAD.ActiveDocument
+        if not (store.dirty or store.qdirty):
+            return
+        doc.openTransaction("Change IFC elements")
+        touched = []
+        try:
+            for row in sorted(store.dirty | store.qdirty):
+                obj = doc.getObject(store.names[row])
+                if not obj:
+                    continue
+                role = None
+                mat = None
+                quantities = None
+                exports = None
+                if row in store.dirty:
+                    role = store.getRoleName(row)
+                    if store.getMaterialName(row):
+                        mat = doc.getObject(store.getMaterialName(row))
+                if row in store.qdirty:
+                    quantities = {}
+                    exports = {}
+                    for i in range(len(qprops)):
+                        if i < 3:
+                            quantities[qprops[i]] = store.quantities[qprops[i]][row]
+                        exports[qprops[i]] = bool(store.exports[row] & (1 << i))
+                if setIfcData(obj,role,mat,quantities,exports):
+                    touched.append(obj)
+        except Exception:
+            # don't leave a half-written transaction open on the document
+            doc.abortTransaction()
+            raise
+        commit(doc,touched)
 
     def editProperties(self):
 
         sel = self.form.tree.selectedIndexes()
         if len(sel) <= 3:
-            obj = FreeCAD.ActiveDocument.getObject(self.model.itemFromIndex(sel[0]).toolTip())
+            obj = FreeCAD.ActiveDocument.getObject(self.model.getName(self.proxy.mapToSource(sel[0])))
             if obj:
                 import ArchComponent
                 p = ArchComponent.ComponentTaskPanel()
@@ -562,14 +474,999 @@ class BIM_IfcElements:
 
     def setChecked(self,id1,id2):
 
+        # propagate a check state change to the whole selection, in one go
+        if id1 != id2:
+            return # a bulk change, not a click
         sel = self.form.quantities.selectedIndexes()
-        state = self.qmodel.itemFromIndex(id1).checkState()
         if len(sel) > 7:
-            for idx in sel:
-                if idx.column() == id1.column():
-                    item = self.qmodel.itemFromIndex(idx)
-                    if item.checkState() != state:
-                        item.setCheckState(state)
+            state = self.qmodel.data(id1,QtCore.Qt.CheckStateRole)
+            rows = [self.qmodel.rows[idx.row()] for idx in sel if idx.column() == id1.column()]
+            self.qmodel.setExports(rows,id1.column()-1,state == QtCore.Qt.Checked)
+
+
+
+def setIfcData(obj,role=None,material=None,quantities=None,exports=None):
+
+    """writes an IFC role, a material object, quantities (a {qprop:value} dictionary)
+    and export flags (a {qprop:bool} dictionary) to an object, skipping the values that
+    are None or didn't change. Returns True if the object was modified"""
+
+    changed = False
+    if role and hasattr(obj,"IfcRole") and (obj.IfcRole != role):
+        obj.IfcRole = role
+        changed = True
+    if material and hasattr(obj,"Material"):
+        if (not obj.Material) or (obj.Material.Name != material.Name):
+            obj.Material = material
+            changed = True
+    if quantities:
+        for prop,val in quantities.items():
+            if hasattr(obj,prop) and (val == val) and (getattr(obj,prop).Value != val):
+                setattr(obj,prop,val)
+                changed = True
+    if exports and hasattr(obj,"IfcAttributes"):
+        # all flags are written at once
+        d = obj.IfcAttributes
+        for prop,state in exports.items():
+            if state:
+                d["Export"+prop] = "True"
+            elif "Export"+prop in d:
+                d["Export"+prop] = "False"
+        if d != obj.IfcAttributes:
+            obj.IfcAttributes = d
+            changed = True
+    return changed
+
+
+def commit(doc,touched):
+
+    "commits the open transaction if any object was touched, and recomputes them"
+
+    if not touched:
+        doc.abortTransaction()
+        return
+    doc.commitTransaction()
+    try:
+        # only recompute the modified objects and their dependents
+        doc.recompute(touched)
+    except TypeError:
+        # versions older than 0.19 can only recompute the whole document
+        doc.recompute()
+
+
+def assign(names,role=None,material=None,exports=None,doc=None):
+
+    """assigns an IFC role, a material name and/or export flags (a {qprop:bool}
+    dictionary) to the objects with the given names, in one transaction, without
+    the dialog. Returns the list of modified objects"""
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    matobj = None
+    if material:
+        matobj = doc.getObject(material)
+    doc.openTransaction("Change IFC elements")
+    touched = []
+    skipped = dict([(prop,[]) for prop in exports or {}])
+    for name in names:
+        obj = doc.getObject(name)
+        if not obj:
+            continue
+        flags = None
+        if exports:
+            # flags of quantities the object doesn't have are left alone, as in the dialog
+            flags = {}
+            for prop,state in exports.items():
+                if BimTakeoff.hasQuantity(obj,prop):
+                    flags[prop] = state
+                else:
+                    skipped[prop].append(obj.Label)
+        if setIfcData(obj,role,matobj,None,flags):
+            touched.append(obj)
+    commit(doc,touched)
+    for prop,labels in skipped.items():
+        warnSkipped(prop,labels)
+    return touched
+
+
+def warnSkipped(prop,labels):
+
+    "reports the objects whose export flag of the given qprop was not set because they don't have it"
+
+    if labels:
+        FreeCAD.Console.PrintWarning("No "+prop+" to export on: "+", ".join(labels)+"\n")
+
+
+def clearCache(doc):
+
+    "drops the cached volumes of the objects of the given document, when it is closed"
+
+    for key in [key for key in quantityCache if key[0] == doc.Name]:
+        del quantityCache[key]
+
+
+def getFingerprint(obj):
+
+    """returns a cheap value that changes whenever the quantities of the given object
+    might have changed: the hash of its shape, its placement and its touched state"""
+
+    p = obj.Placement
+    return (obj.Shape.hashCode(),tuple(p.Base),tuple(p.Rotation.Q),"Touched" in obj.State)
+
+
+def getHierarchy(objs):
+
+    """returns a (hierarchy,cycles) tuple from a list of objects. hierarchy is a list
+    of (name,parentname) tuples in topological order, parentname being None for top
+    objects, and cycles lists the names of objects involved in circular dependencies"""
+
+    # single pass parent index over the OutList of each object
+    names = set([obj.Name for obj in objs])
+    children = {}
+    indegree = dict([(name,0) for name in names])
+    for obj in objs:
+        children[obj.Name] = []
+        for child in obj.OutList:
+            if (child.Name in names) and (child.Name != obj.Name):
+                children[obj.Name].append(child.Name)
+                indegree[child.Name] += 1
+
+    # Kahn's algorithm: an object is only placed once all its parents are placed
+    from collections import deque
+    queue = deque([obj.Name for obj in objs if not indegree[obj.Name]])
+    parents = dict([(name,None) for name in queue])
+    hierarchy = []
+    while queue:
+        name = queue.popleft()
+        hierarchy.append((name,parents[name]))
+        for child in children[name]:
+            if not child in parents:
+                parents[child] = name
+            indegree[child] -= 1
+            if not indegree[child]:
+                queue.append(child)
+
+    # what remains is part of, or depends on, a cycle
+    cycles = [obj.Name for obj in objs if indegree[obj.Name]]
+    hierarchy.extend([(name,parents.get(name)) for name in cycles])
+    return hierarchy,cycles
+
+
+class IfcElementsStore:
+
+
+    "a compact, columnar storage of the objects handled by the IFC elements manager"
+
+    def __init__(self,roles):
+
+        # one entry per object in each of these columns. The row of an object is its position
+        self.names = []
+        self.labels = []
+        self.index = {} # name: row
+        self.types = array("i") # indices in self.typenames
+        self.roles = array("i") # indices in self.rolenames
+        self.orgroles = array("i")
+        self.mats = array("i") # indices in self.matnames, -1 if no material
+        self.orgmats = array("i")
+        self.quantities = dict([(prop,array("d")) for prop in qprops]) # NaN if not available
+        self.exports = array("i") # bit i set if qprops[i] is exported
+        self.visible = array("b") # 1 if the object is visible in the 3D view
+        self.dirty = set() # rows whose role or material was edited
+        self.qdirty = set() # rows whose quantities or export flags were edited
+
+        # interned strings
+        self.typenames = []
+        self.typeindex = {}
+        self.rolenames = []
+        self.roleindex = {}
+        for role in roles:
+            self.internRole(role)
+        self.matnames = []
+        self.matlabels = []
+        self.matindex = {}
+
+    def intern(self,table,index,value):
+
+        "returns the position of value in table, adding it if needed"
+
+        if not value in index:
+            index[value] = len(table)
+            table.append(value)
+        return index[value]
+
+    def internRole(self,role):
+
+        return self.intern(self.rolenames,self.roleindex,role)
+
+    def internMaterial(self,mat):
+
+        "returns the index of the given material object, -1 if None"
+
+        if not mat:
+            return -1
+        if not mat.Name in self.matindex:
+            self.matlabels.append(mat.Label)
+        return self.intern(self.matnames,self.matindex,mat.Name)
+
+    def renameMaterial(self,mat):
+
+        "updates the label of the given material object. Returns its index, -1 if not used"
+
+        i = self.matindex.get(mat.Name,-1)
+        if i >= 0:
+            self.matlabels[i] = mat.Label
+        return i
+
+    def add(self,obj):
+
+        "adds an object to the store and returns its row"
+
+        row = len(self.names)
+        self.names.append(obj.Name)
+        self.labels.append(obj.Label)
+        self.index[obj.Name] = row
+        t = ""
+        if hasattr(obj,"Proxy") and hasattr(obj.Proxy,"Type"):
+            t = obj.Proxy.Type
+        self.types.append(self.intern(self.typenames,self.typeindex,t))
+        r = self.internRole(obj.IfcRole)
+        self.roles.append(r)
+        self.orgroles.append(r)
+        m = -1
+        if hasattr(obj,"Material"):
+            m = self.internMaterial(obj.Material)
+        self.mats.append(m)
+        self.orgmats.append(m)
+        for prop in qprops:
+            self.quantities[prop].append(float("nan"))
+        self.exports.append(0)
+        self.visible.append(bool(obj.ViewObject and obj.ViewObject.isVisible()))
+        return row
+
+    def readQuantities(self,row,obj):
+
+        """reads the quantities of the given object into the given row, except the volume
+        which is expensive to compute. Returns the shape to compute the volume from, if any"""
+
+        for prop,val in zip(qprops,BimTakeoff.getQuantities(obj,volume=False)):
+            if val != None:
+                self.quantities[prop][row] = val
+        if obj.Shape and hasattr(obj.Shape,"Volume"):
+            return obj.Shape
+        return None
+
+    def readExports(self,row,obj):
+
+        "reads which quantities of the given object are exported to IFC"
+
+        self.exports[row] = 0
+        for i,exported in enumerate(BimTakeoff.getExports(obj)):
+            if exported:
+                self.exports[row] |= 1 << i
+
+    def getTypeName(self,row):
+
+        return self.typenames[self.types[row]]
+
+    def getRoleName(self,row):
+
+        return self.rolenames[self.roles[row]]
+
+    def getMaterialName(self,row):
+
+        if self.mats[row] < 0:
+            return ""
+        return self.matnames[self.mats[row]]
+
+    def getMaterialLabel(self,row):
+
+        if self.mats[row] < 0:
+            return ""
+        return self.matlabels[self.mats[row]]
+
+
+
+class IfcElementsModel(BimModels.LazyTreeModel):
+
+
+    "a tree model that renders the rows of an IfcElementsStore on demand, optionally grouped"
+
+    def __init__(self,store):
+
+        BimModels.LazyTreeModel.__init__(self)
+        self.store = store
+        self.editIcon = BimIcons.getIcon(":/icons/edit-edit.svg")
+        self.groupmode = 0
+        self.clear()
+
+    def clear(self):
+
+        # row+1 is an object of the store, and anything above len(store.names) is a group
+        BimModels.LazyTreeModel.clear(self)
+        n = len(self.store.names)+1
+        self.children = {0:[]} # node: list of child nodes
+        self.parents = array("i",[0])*n # node: parent node
+        self.positions = array("i",[-1])*n # node: position in its parent, -1 if not in the tree
+        self.groups = {} # group key: node
+        self.groupkeys = {} # node: group key
+
+    def build(self,hierarchy,groupmode=0):
+
+        "rebuilds the tree from a list of (row, parent row) tuples, in the given group mode"
+
+        self.beginResetModel()
+        self.clear()
+        self.groupmode = groupmode
+        for row,parent in hierarchy:
+            if groupmode in [1,2]:
+                key = self.getGroupKey(row)
+                if not key in self.groups:
+                    self.children[0].append(self.makeGroup(key))
+                parent = self.groups[key]
+            else:
+                parent = parent+1
+            self.children.setdefault(parent,[]).append(row+1)
+        for parent,children in self.children.items():
+            children.sort(key=self.getSortKey)
+            for pos,node in enumerate(children):
+                self.parents[node] = parent
+                self.positions[node] = pos
+        self.endResetModel()
+
+    def makeGroup(self,key):
+
+        "creates a new group node, not yet inserted in the tree"
+
+        node = len(self.parents)
+        self.parents.append(0)
+        self.positions.append(-1)
+        self.children[node] = []
+        self.groups[key] = node
+        self.groupkeys[node] = key
+        return node
+
+    def getGroupKey(self,row):
+
+        if self.groupmode == 1:
+            return self.store.roles[row]
+        elif self.groupmode == 2:
+            return self.store.mats[row]
+        return None
+
+    def getGroupLabel(self,node):
+
+        key = self.groupkeys[node]
+        if self.groupmode == 1:
+            return self.store.rolenames[key]
+        elif key >= 0:
+            return self.store.matlabels[key]
+        return "Undefined"
+
+    def getSortKey(self,node):
+
+        if node in self.groupkeys:
+            return self.getGroupLabel(node)
+        return self.store.labels[node-1]
+
+    def getChildren(self,node):
+
+        return self.children.get(node,[])
+
+    def getParent(self,node):
+
+        return self.parents[node]
+
+    def getRow(self,index):
+
+        "returns the store row of the given index, or -1 if it is not an object"
+
+        node = self.getNode(index)
+        if (node == 0) or (node in self.groupkeys):
+            return -1
+        return node-1
+
+    def getName(self,index):
+
+        "returns the name of the object at the given index, or an empty string"
+
+        row = self.getRow(index)
+        if row < 0:
+            return ""
+        return self.store.names[row]
+
+    def isGroup(self,index):
+
+        return self.getNode(index) in self.groupkeys
+
+    # QAbstractItemModel interface
+
+    def columnCount(self,parent=QtCore.QModelIndex()):
+
+        return 3
+
+    def fetchAll(self):
+
+        "exposes all the nodes to the views at once, as needed to filter or sort all of them"
+
+        nodes = [0]
+        while nodes:
+            node = nodes.pop()
+            children = self.children.get(node,[])
+            first = self.fetched.get(node,0)
+            if first < len(children):
+                self.beginInsertRows(self.getIndex(node),first,len(children)-1)
+                self.fetched[node] = len(children)
+                self.endInsertRows()
+            nodes.extend([child for child in children if child in self.children])
+
+    def headerData(self,section,orientation,role=QtCore.Qt.DisplayRole):
+
+        if (orientation == QtCore.Qt.Horizontal) and (role == QtCore.Qt.DisplayRole):
+            return ["Label","IFC type","Material"][section]
+        return None
+
+    def flags(self,index):
+
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        if self.isGroup(index):
+            return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEditable
+
+    def data(self,index,role=QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+        node = self.getNode(index)
+        column = index.column()
+        if node in self.groupkeys:
+            if (column == 0) and (role == QtCore.Qt.DisplayRole):
+                return self.getGroupLabel(node)+" ("+str(len(self.children[node]))+")"
+            return None
+        row = node-1
+        store = self.store
+        if column == 0:
+            if role in [QtCore.Qt.DisplayRole,QtCore.Qt.EditRole]:
+                return store.labels[row]
+            elif role == QtCore.Qt.ToolTipRole:
+                return store.names[row]
+            elif role == QtCore.Qt.DecorationRole:
+                return BimIcons.getTypeIcon(store.getTypeName(row))
+        elif column == 1:
+            if role in [QtCore.Qt.DisplayRole,QtCore.Qt.EditRole]:
+                return store.getRoleName(row)
+            elif role == QtCore.Qt.DecorationRole:
+                if store.roles[row] != store.orgroles[row]:
+                    return self.editIcon
+        elif column == 2:
+            if role in [QtCore.Qt.DisplayRole,QtCore.Qt.EditRole]:
+                return store.getMaterialLabel(row)
+            elif role == QtCore.Qt.ToolTipRole:
+                return store.getMaterialName(row)
+            elif role == QtCore.Qt.DecorationRole:
+                if (store.mats[row] >= 0) and (store.mats[row] != store.orgmats[row]):
+                    return self.editIcon
+        return None
+
+    def setData(self,index,value,role=QtCore.Qt.EditRole):
+
+        # only labels are edited directly, roles and materials go through setRole and setMaterial
+        row = self.getRow(index)
+        if (row < 0) or (index.column() != 0) or (role != QtCore.Qt.EditRole):
+            return False
+        self.store.labels[row] = value
+        self.dataChanged.emit(index,index)
+        return True
+
+    # incremental edits
+
+    def setRole(self,row,role):
+
+        "sets the role index of a store row, and only updates its row in the tree"
+
+        if self.store.roles[row] == role:
+            return False
+        self.store.roles[row] = role
+        self.store.dirty.add(row)
+        self.rowChanged(row)
+        if self.groupmode == 1:
+            self.regroup(row)
+        return True
+
+    def setMaterial(self,row,mat):
+
+        "sets the material index of a store row, and only updates its row in the tree"
+
+        if self.store.mats[row] == mat:
+            return False
+        self.store.mats[row] = mat
+        self.store.dirty.add(row)
+        self.rowChanged(row)
+        if self.groupmode == 2:
+            self.regroup(row)
+        return True
+
+    def assign(self,rows,role=None,mat=None):
+
+        """sets the role and/or material index of many store rows at once, and notifies
+        the views only once at the end"""
+
+        changed = []
+        for row in rows:
+            modified = False
+            if (role != None) and (self.store.roles[row] != role):
+                self.store.roles[row] = role
+                modified = True
+            if (mat != None) and (self.store.mats[row] != mat):
+                self.store.mats[row] = mat
+                modified = True
+            if modified:
+                changed.append(row)
+        if not changed:
+            return False
+        self.store.dirty.update(changed)
+        if ((self.groupmode == 1) and (role != None)) or ((self.groupmode == 2) and (mat != None)):
+            # rows change groups: rebuild the groups
+            self.build([(node-1,-1) for node in range(1,len(self.store.names)+1) if self.positions[node] >= 0],self.groupmode)
+        else:
+            # one range per parent
+            ranges = {}
+            for row in changed:
+                node = row+1
+                parent = self.parents[node]
+                pos = self.positions[node]
+                if 0 <= pos < self.fetched.get(parent,0):
+                    first,last = ranges.get(parent,(pos,pos))
+                    ranges[parent] = (min(first,pos),max(last,pos))
+            for parent,(first,last) in ranges.items():
+                index = self.getIndex(parent)
+                self.dataChanged.emit(self.index(first,1,index),self.index(last,2,index))
+        return True
+
+    def materialChanged(self,mat):
+
+        "refreshes the rows using the given material, and its group, after it was renamed"
+
+        # one range per parent
+        ranges = {}
+        for row,m in enumerate(self.store.mats):
+            if m == mat:
+                node = row+1
+                parent = self.parents[node]
+                pos = self.positions[node]
+                if 0 <= pos < self.fetched.get(parent,0):
+                    first,last = ranges.get(parent,(pos,pos))
+                    ranges[parent] = (min(first,pos),max(last,pos))
+        for parent,(first,last) in ranges.items():
+            index = self.getIndex(parent)
+            self.dataChanged.emit(self.index(first,2,index),self.index(last,2,index))
+        if (self.groupmode == 2) and (mat in self.groups):
+            index = self.getIndex(self.groups[mat])
+            if index.isValid():
+                self.dataChanged.emit(index,index)
+
+    def rowChanged(self,row):
+
+        index = self.getIndex(row+1,1)
+        if index.isValid():
+            self.dataChanged.emit(index,index.sibling(index.row(),2))
+
+    def regroup(self,row):
+
+        "moves a row to the group it now belongs to"
+
+        node = row+1
+        if self.positions[node] < 0:
+            return
+        old = self.parents[node]
+        key = self.getGroupKey(row)
+        if self.groups.get(key) == old:
+            return
+        self.removeNode(node)
+        if not key in self.groups:
+            self.insertNode(0,self.makeGroup(key))
+        self.insertNode(self.groups[key],node)
+        for group in [old,self.groups[key]]:
+            if not self.children.get(group):
+                self.removeNode(group)
+                del self.groups[self.groupkeys[group]]
+                del self.groupkeys[group]
+                del self.children[group]
+            else:
+                index = self.getIndex(group)
+                if index.isValid():
+                    self.dataChanged.emit(index,index)
+
+    def removeNode(self,node):
+
+        parent = self.parents[node]
+        pos = self.positions[node]
+        children = self.children[parent]
+        exposed = (pos < self.fetched.get(parent,0)) and self.isExposed(parent)
+        if exposed:
+            self.beginRemoveRows(self.getIndex(parent),pos,pos)
+        del children[pos]
+        for i in range(pos,len(children)):
+            self.positions[children[i]] = i
+        self.positions[node] = -1
+        if exposed:
+            self.fetched[parent] -= 1
+            self.endRemoveRows()
+
+    def insertNode(self,parent,node):
+
+        "inserts a node under the given parent, keeping children sorted"
+
+        children = self.children.setdefault(parent,[])
+        key = self.getSortKey(node)
+        lo = 0
+        hi = len(children)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self.getSortKey(children[mid]) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        # the views are only told about rows they can see: the parent must be known to
+        # them, and the new row must fall within the rows they have already fetched
+        fetched = self.fetched.get(parent,0)
+        exposed = self.isExposed(parent) and ((lo < fetched) or (fetched == len(children)))
+        if exposed:
+            self.beginInsertRows(self.getIndex(parent),lo,lo)
+        children.insert(lo,node)
+        for i in range(lo,len(children)):
+            self.positions[children[i]] = i
+        self.parents[node] = parent
+        if exposed:
+            self.fetched[parent] = fetched+1
+            self.endInsertRows()
+
+
+
+class IfcElementsFilter(QSortFilterProxyModel):
+
+
+    "a proxy model that filters and sorts the rows of an IfcElementsModel without rebuilding it"
+
+    def __init__(self,model):
+
+        QSortFilterProxyModel.__init__(self)
+        self.onlyVisible = False
+        self.text = ""
+        self.roles = None # a set of role indices, or None
+        self.mats = None # a set of material indices, or None
+        self.accepted = {} # node: bool, cleared whenever filters or data change
+        # connected before setting the source, so the cache is cleared before the proxy reacts
+        for signal in ["dataChanged(QModelIndex,QModelIndex)","modelReset()","rowsInserted(QModelIndex,int,int)","rowsRemoved(QModelIndex,int,int)"]:
+            QtCore.QObject.connect(model, QtCore.SIGNAL(signal), self.clearCache)
+        self.setSourceModel(model)
+        self.setDynamicSortFilter(True)
+        self.setSortCaseSensitivity(QtCore.Qt.CaseInsensitive)
+
+    def clearCache(self,*args):
+
+        self.accepted = {}
+
+    def isFiltering(self):
+
+        return self.onlyVisible or bool(self.text) or (self.roles != None) or (self.mats != None)
+
+    def refresh(self):
+
+        "reapplies the filters"
+
+        self.accepted = {}
+        if self.isFiltering():
+            self.sourceModel().fetchAll()
+        self.invalidateFilter()
+
+    def setOnlyVisible(self,state):
+
+        self.onlyVisible = state
+        self.refresh()
+
+    def setText(self,text):
+
+        self.text = text.lower()
+        self.refresh()
+
+    def setRoles(self,roles):
+
+        "only shows the given role indices, or all if None"
+
+        self.roles = roles
+        if roles != None:
+            self.roles = set(roles)
+        self.refresh()
+
+    def setMaterials(self,mats):
+
+        "only shows the given material indices, or all if None"
+
+        self.mats = mats
+        if mats != None:
+            self.mats = set(mats)
+        self.refresh()
+
+    def filterAcceptsRow(self,sourceRow,sourceParent):
+
+        if not self.isFiltering():
+            return True
+        model = self.sourceModel()
+        return self.acceptsNode(model.children[model.getNode(sourceParent)][sourceRow])
+
+    def acceptsNode(self,node):
+
+        "a node is shown if it passes the filters, or if any of its descendants does"
+
+        if not node in self.accepted:
+            model = self.sourceModel()
+            accepted = (not node in model.groupkeys) and self.acceptsRow(node-1)
+            if not accepted:
+                for child in model.children.get(node,[]):
+                    if self.acceptsNode(child):
+                        accepted = True
+                        break
+            self.accepted[node] = accepted
+        return self.accepted[node]
+
+    def acceptsRow(self,row):
+
+        store = self.sourceModel().store
+        if self.onlyVisible and not store.visible[row]:
+            return False
+        if (self.roles != None) and (not store.roles[row] in self.roles):
+            return False
+        if (self.mats != None) and (not store.mats[row] in self.mats):
+            return False
+        if self.text and (not self.text in store.labels[row].lower()):
+            return False
+        return True
+
+
+
+class IfcElementsObserver:
+
+
+    "a document observer that reports visibility and material changes to the IFC elements dialog"
+
+    def __init__(self,dialog):
+
+        self.dialog = dialog
+
+    def slotCreatedObject(self,obj):
+
+        if obj.isDerivedFrom("App::MaterialObject"):
+            self.dialog.addMaterial(obj)
+
+    def slotDeletedObject(self,obj):
+
+        if obj.isDerivedFrom("App::MaterialObject"):
+            self.dialog.removeMaterial(obj)
+
+    def slotChangedObject(self,obj,prop):
+
+        if prop == "Visibility":
+            self.dialog.setVisibility(obj)
+        elif (prop == "Label") and obj.isDerivedFrom("App::MaterialObject"):
+            self.dialog.renameMaterial(obj)
+
+
+
+class IfcElementsChoices:
+
+
+    """the roles and materials offered by the combo boxes of the dialog, as list models
+    shared by all the editors. The first entry of each list is an empty choice"""
+
+    def __init__(self,roles):
+
+        self.rolenames = [""]+list(roles)
+        self.roleindex = dict([(name,i) for i,name in enumerate(self.rolenames)])
+        self.roles = QStringListModel([" "]+list(roles))
+        self.matnames = [""]
+        self.matindex = {"":0}
+        labels = [" "]
+        for obj in BimIndex.getMaterials():
+            self.matindex[obj.Name] = len(self.matnames)
+            self.matnames.append(obj.Name)
+            labels.append(obj.Label)
+        self.materials = QStringListModel(labels)
+
+    def addMaterial(self,obj):
+
+        if obj.Name in self.matindex:
+            return
+        i = len(self.matnames)
+        self.matindex[obj.Name] = i
+        self.matnames.append(obj.Name)
+        self.materials.insertRows(i,1)
+        self.materials.setData(self.materials.index(i),obj.Label)
+
+    def removeMaterial(self,name):
+
+        i = self.matindex.pop(name,None)
+        if i is None:
+            return
+        del self.matnames[i]
+        for j in range(i,len(self.matnames)):
+            self.matindex[self.matnames[j]] = j
+        self.materials.removeRows(i,1)
+
+    def renameMaterial(self,obj):
+
+        i = self.matindex.get(obj.Name)
+        if i != None:
+            self.materials.setData(self.materials.index(i),obj.Label)
+
+
+
+class IfcQuantitiesModel(QtCore.QAbstractTableModel):
+
+
+    "a table model that renders the quantities of an IfcElementsStore on demand"
+
+    batch = 1000
+
+    def __init__(self,store):
+
+        QtCore.QAbstractTableModel.__init__(self)
+        self.store = store
+        self.rows = array("i") # store rows shown in this table
+        self.fetched = 0
+        self.pending = set() # store rows whose volume is still being computed
+        self.warningIcon = BimIcons.getIcon(os.path.join(os.path.dirname(__file__),"icons","warning.svg"))
+
+    def setRows(self,rows):
+
+        self.beginResetModel()
+        self.rows = array("i",rows)
+        self.fetched = 0
+        self.endResetModel()
+
+    def setExports(self,rows,i,state):
+
+        """sets the export flag of the qprop number i of many store rows at once, and
+        notifies the views only once at the end. Rows without that quantity are skipped,
+        like the module-level assign() does, and reported"""
+
+        bit = 1 << i
+        changed = []
+        skipped = []
+        for row in rows:
+            val = self.store.quantities[qprops[i]][row]
+            if (val != val) and not ((i == len(qprops)-1) and (row in self.pending)):
+                skipped.append(self.store.labels[row]) # no such quantity
+                continue
+            if bool(self.store.exports[row] & bit) != state:
+                if state:
+                    self.store.exports[row] |= bit
+                else:
+                    self.store.exports[row] &= ~bit
+                changed.append(row)
+        warnSkipped(qprops[i],skipped)
+        if not changed:
+            return False
+        self.store.qdirty.update(changed)
+        if self.fetched:
+            self.dataChanged.emit(self.index(0,i+1),self.index(self.fetched-1,i+1))
+        return True
+
+    def setComputed(self,rows):
+
+        "marks the volume of the given store rows as computed"
+
+        self.pending.difference_update(rows)
+        if self.fetched:
+            column = len(qprops)
+            self.dataChanged.emit(self.index(0,column),self.index(self.fetched-1,column))
+
+    def rowCount(self,parent=QtCore.QModelIndex()):
+
+        if parent.isValid():
+            return 0
+        return self.fetched
+
+    def columnCount(self,parent=QtCore.QModelIndex()):
+
+        return len(qprops)+1
+
+    def canFetchMore(self,parent):
+
+        return (not parent.isValid()) and (self.fetched < len(self.rows))
+
+    def fetchMore(self,parent):
+
+        last = min(len(self.rows),self.fetched+self.batch)-1
+        if last >= self.fetched:
+            self.beginInsertRows(parent,self.fetched,last)
+            self.fetched = last+1
+            self.endInsertRows()
+
+    def headerData(self,section,orientation,role=QtCore.Qt.DisplayRole):
+
+        if (orientation == QtCore.Qt.Horizontal) and (role == QtCore.Qt.DisplayRole):
+            return ["Label","Length","Width","Height","Area","Horiz Area","Vert Area","Volume"][section]
+        return None
+
+    def getValue(self,index):
+
+        "returns the stored value at the given index, or None"
+
+        if index.column() < 1:
+            return None
+        val = self.store.quantities[qprops[index.column()-1]][self.rows[index.row()]]
+        if val != val: # NaN
+            return None
+        return val
+
+    def flags(self,index):
+
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if self.getValue(index) != None:
+            flags |= QtCore.Qt.ItemIsUserCheckable
+            if index.column() <= 3:
+                flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def data(self,index,role=QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if (index.column() == len(qprops)) and (row in self.pending):
+            if role == QtCore.Qt.DisplayRole:
+                return "..."
+            return None
+        if index.column() == 0:
+            if role == QtCore.Qt.DisplayRole:
+                return self.store.labels[row]
+            elif role == QtCore.Qt.ToolTipRole:
+                return self.store.names[row]
+            elif role == QtCore.Qt.DecorationRole:
+                return BimIcons.getTypeIcon(self.store.getTypeName(row))
+            return None
+        val = self.getValue(index)
+        if val == None:
+            return None
+        i = index.column()-1
+        if role in [QtCore.Qt.DisplayRole,QtCore.Qt.EditRole]:
+            q = FreeCAD.Units.Quantity(val,getattr(FreeCAD.Units,qunits[i]))
+            return q.getUserPreferred()[0].replace(u"^2",u"²").replace(u"^3",u"³")
+        elif role == QtCore.Qt.CheckStateRole:
+            if self.store.exports[row] & (1 << i):
+                return QtCore.Qt.Checked
+            return QtCore.Qt.Unchecked
+        elif role == QtCore.Qt.DecorationRole:
+            if val == 0:
+                return self.warningIcon
+        return None
+
+    def setData(self,index,value,role=QtCore.Qt.EditRole):
+
+        if self.getValue(index) == None:
+            return False
+        row = self.rows[index.row()]
+        i = index.column()-1
+        if role == QtCore.Qt.CheckStateRole:
+            if value == QtCore.Qt.Checked:
+                self.store.exports[row] |= 1 << i
+            else:
+                self.store.exports[row] &= ~(1 << i)
+        elif role == QtCore.Qt.EditRole:
+            try:
+                val = FreeCAD.Units.Quantity(value).Value
+            except ValueError:
+                return False
+            self.store.quantities[qprops[i]][row] = val
+        else:
+            return False
+        self.store.qdirty.add(row)
+        self.dataChanged.emit(index,index)
+        return True
+
 
 
 class IfcElementsDelegate(QtGui.QStyledItemDelegate):
@@ -577,15 +1474,8 @@ class IfcElementsDelegate(QtGui.QStyledItemDelegate):
 
     def __init__(self, parent=None, dialog=None, *args):
 
-        import ArchComponent,Arch_rc
-        self.roles = ArchComponent.IfcRoles
-        self.mats = []
-        self.matlabels = []
-        for o in FreeCAD.ActiveDocument.Objects:
-            if o.isDerivedFrom("App::MaterialObject"):
-                self.mats.append(o.Name)
-                self.matlabels.append(o.Label)
         self.dialog = dialog
+        self.choices = dialog.choices
         self.btn = QtGui.QPushButton()
         self.btn.setIcon(QtGui.QIcon(":/icons/IFC.svg"))
         self.btn.setText("")
@@ -612,42 +1502,34 @@ class IfcElementsDelegate(QtGui.QStyledItemDelegate):
 
     def setEditorData(self, editor, index):
 
+        # the combo boxes share the list models of the dialog instead of copying them
         if index.column() == 1:
-            idx = -1
-            editor.addItems(self.roles)
-            if index.data() in self.roles:
-                idx = self.roles.index(index.data())
-            editor.setCurrentIndex(idx)
+            editor.setModel(self.choices.roles)
+            editor.setCurrentIndex(self.choices.roleindex.get(index.data(),0))
         elif index.column() == 2:
-            idx = -1
-            editor.addItems(self.matlabels)
-            item = index.model().itemFromIndex(index)
-            if item.toolTip() in self.mats:
-                idx = self.mats.index(item.toolTip())
-            editor.setCurrentIndex(idx)
+            editor.setModel(self.choices.materials)
+            editor.setCurrentIndex(self.choices.matindex.get(index.data(QtCore.Qt.ToolTipRole),0))
         else:
             editor.setText(index.data())
 
     def setModelData(self, editor, model, index):
 
+        # only the edited row is updated, the rest of the tree is left untouched
+        name = self.dialog.model.getName(model.mapToSource(index))
+        if not name:
+            return
         if index.column() == 1:
-            if editor.currentIndex() == -1:
-                model.setData(index, "")
-            else:
-                model.setData(index,self.roles[editor.currentIndex()])
-        if index.column() == 2:
-            if editor.currentIndex() > -1:
-                idx = editor.currentIndex()
-                item = model.itemFromIndex(index)
-                item.setText(self.matlabels[idx])
-                item.setToolTip(self.mats[idx])
+            # the blank entry is not a valid IfcRole, it leaves the role unchanged
+            if editor.currentIndex() > 0:
+                self.dialog.setRole(name,self.choices.rolenames[editor.currentIndex()])
+        elif index.column() == 2:
+            if editor.currentIndex() > 0:
+                self.dialog.setMaterial(name,self.choices.matnames[editor.currentIndex()])
         else:
             model.setData(index,editor.text())
-            item = model.itemFromIndex(index)
-            obj = FreeCAD.ActiveDocument.getObject(item.toolTip())
+            obj = FreeCAD.ActiveDocument.getObject(name)
             if obj:
                 obj.Label = editor.text()
-        self.dialog.update()
 
 
 FreeCADGui.addCommand('BIM_IfcElements',BIM_IfcElements())
@@ -0,0 +1,288 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+"""This module contains an index of the objects of FreeCAD documents, by type,
+IFC role, material and parent. It is kept up to date by the BimDocumentObserver
+while the BIM workbench is active, so BIM dialogs don't need to scan all the
+objects of a document to find the ones they need."""
+
+import FreeCAD
+
+indexes = {} # document name: DocumentIndex
+
+
+def getIndex(doc=None):
+
+    """returns the index of the given document (the active one by default). If the
+    BimDocumentObserver is not running to keep it up to date, a fresh index is built"""
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    if not doc:
+        return None
+    if not hasattr(FreeCAD,"BimDocumentObserver"):
+        return DocumentIndex(doc)
+    if not doc.Name in indexes:
+        indexes[doc.Name] = DocumentIndex(doc)
+    return indexes[doc.Name]
+
+
+def clear(doc=None):
+
+    "drops the index of the given document, or of all documents"
+
+    if doc:
+        if doc.Name in indexes:
+            del indexes[doc.Name]
+    else:
+        indexes.clear()
+
+
+def getObjects(doc=None,**keys):
+
+    "shortcut for getIndex(doc).getObjects(**keys)"
+
+    index = getIndex(doc)
+    if not index:
+        return []
+    return index.getObjects(**keys)
+
+
+def getMaterials(doc=None):
+
+    "shortcut for getIndex(doc).getMaterials()"
+
+    index = getIndex(doc)
+    if not index:
+        return []
+    return index.getMaterials()
+
+
+# functions called by the BimDocumentObserver
+
+def onCreated(obj):
+
+    if obj.Document.Name in indexes:
+        indexes[obj.Document.Name].add(obj)
+
+
+def onDeleted(obj):
+
+    if obj.Document.Name in indexes:
+        indexes[obj.Document.Name].discard(obj.Name)
+
+
+def onChanged(obj,prop):
+
+    if obj.Document.Name in indexes:
+        indexes[obj.Document.Name].change(obj,prop)
+
+
+
+class DocumentIndex:
+
+
+    "the index of the objects of one document"
+
+    # the properties that change the keys an object is indexed with
+    properties = ["Proxy","IfcRole","Material","Group"]
+
+    def __init__(self,doc):
+
+        self.doc = doc
+        self.counter = 0
+        self.order = {} # name: creation order, to return objects in document order
+        self.entries = {} # name: (type,role,material)
+        self.types = {} # type: set of names
+        self.roles = {} # IFC role: set of names
+        self.materials = {} # material name: set of names
+        self.children = {} # parent name: set of names
+        self.parents = {} # name: parent name
+        self.materialobjects = set() # names of the App::MaterialObjects
+        self.descendants = {} # name: all the objects contained in it, built when needed
+        self.pending = set() # names of the objects whose keys must be checked again
+        for obj in doc.Objects:
+            self.setKeys(obj)
+
+    def getKeys(self,obj):
+
+        import Draft
+        role = None
+        if hasattr(obj,"IfcRole"):
+            role = obj.IfcRole
+        mat = None
+        if hasattr(obj,"Material") and hasattr(obj.Material,"Name"):
+            mat = obj.Material.Name
+        return (Draft.getType(obj),role,mat)
+
+    def add(self,obj):
+
+        """adds or re-indexes an object. Objects being created only get their final type
+        after being added (Arch objects set it after their Proxy), so their keys are
+        checked again at the next query"""
+
+        self.setKeys(obj)
+        self.pending.add(obj.Name)
+
+    def refresh(self):
+
+        "re-indexes the objects added or changed since the last query, if their keys changed"
+
+        for name in self.pending:
+            obj = self.doc.getObject(name)
+            if obj and (self.entries.get(name) != self.getKeys(obj)):
+                self.setKeys(obj)
+        self.pending.clear()
+
+    def setKeys(self,obj):
+
+        if obj.Name in self.entries:
+            self.discard(obj.Name,keepchildren=True)
+        else:
+            self.order[obj.Name] = self.counter
+            self.counter += 1
+        entry = self.getKeys(obj)
+        self.entries[obj.Name] = entry
+        self.types.setdefault(entry[0],set()).add(obj.Name)
+        if entry[1] != None:
+            self.roles.setdefault(entry[1],set()).add(obj.Name)
+        if entry[2] != None:
+            self.materials.setdefault(entry[2],set()).add(obj.Name)
+        if obj.isDerivedFrom("App::MaterialObject"):
+            self.materialobjects.add(obj.Name)
+        self.setChildren(obj)
+
+    def setChildren(self,obj):
+
+        "indexes the contents of a group-like object"
+
+        group = set()
+        if hasattr(obj,"Group"):
+            group = set([child.Name for child in obj.Group])
+        if group != self.children.get(obj.Name,set()):
+            self.descendants.clear()
+        for child in self.children.get(obj.Name,set()):
+            if self.parents.get(child) == obj.Name:
+                del self.parents[child]
+        self.children.pop(obj.Name,None)
+        if hasattr(obj,"Group"):
+            self.children[obj.Name] = set()
+            for child in obj.Group:
+                self.children[obj.Name].add(child.Name)
+                self.parents[child.Name] = obj.Name
+
+    def discard(self,name,keepchildren=False):
+
+        "removes an object from the index"
+
+        entry = self.entries.pop(name,None)
+        if not entry:
+            return
+        for table,key in [(self.types,entry[0]),(self.roles,entry[1]),(self.materials,entry[2])]:
+            if key in table:
+                table[key].discard(name)
+                if not table[key]:
+                    del table[key]
+        self.materialobjects.discard(name)
+        if not keepchildren:
+            self.pending.discard(name)
+            if (name in self.children) or (name in self.parents):
+                self.descendants.clear()
+            del self.order[name]
+            for child in self.children.pop(name,set()):
+                if self.parents.get(child) == name:
+                    del self.parents[child]
+            parent = self.parents.pop(name,None)
+            if parent in self.children:
+                self.children[parent].discard(name)
+
+    def change(self,obj,prop):
+
+        "updates the index after a property of an object changed"
+
+        if prop in self.properties:
+            if obj.Name in self.entries:
+                if prop == "Group":
+                    self.setChildren(obj)
+                else:
+                    self.add(obj)
+
+    def sort(self,names):
+
+        "returns the objects with the given names, in document order"
+
+        objs = [self.doc.getObject(name) for name in sorted(names,key=self.order.get)]
+        return [obj for obj in objs if obj]
+
+    def getObjects(self,type=None,role=None,material=None,parent=None):
+
+        """returns the objects matching all the given keys, in document order. Each key can
+        also be a list of values, any of which matches. If role is True, all the objects
+        having an IFC role are returned"""
+
+        self.refresh()
+        sets = []
+        if role == True:
+            sets.append(set().union(*self.roles.values()))
+            role = None
+        for table,key in [(self.types,type),(self.roles,role),(self.materials,material),(self.children,parent)]:
+            if isinstance(key,(list,tuple)):
+                sets.append(set().union(*[table.get(k,set()) for k in key]))
+            elif key != None:
+                sets.append(table.get(key,set()))
+        if not sets:
+            return self.sort(self.entries.keys())
+        sets.sort(key=len)
+        return self.sort(sets[0].intersection(*sets[1:]))
+
+    def getMaterials(self):
+
+        "returns all the material objects, in document order"
+
+        self.refresh()
+        return self.sort(self.materialobjects)
+
+    def getDescendants(self,name):
+
+        """returns the names of all the objects contained in the given group-like object,
+        at any depth. The result is cached until the contents of a group change"""
+
+        if not name in self.descendants:
+            result = set()
+            todo = [name]
+            while todo:
+                for child in self.children.get(todo.pop(),()):
+                    if not child in result:
+                        result.add(child)
+                        todo.append(child)
+            result.discard(name)
+            self.descendants[name] = frozenset(result)
+        return self.descendants[name]
+
+    def getParent(self,obj):
+
+        "returns the group-like object that contains the given object, if any"
+
+        if obj.Name in self.parents:
+            return self.doc.getObject(self.parents[obj.Name])
+        return None
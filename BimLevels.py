@@ -48,6 +48,7 @@ class BIM_Levels_TaskPanel:
     def __init__(self):
 
         from PySide import QtCore,QtGui
+        self.proposals = [] # detected levels not created yet
         self.form = FreeCADGui.PySideUic.loadUi(os.path.join(os.path.dirname(__file__),"dialogLevels.ui"))
         self.form.setWindowIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","BIM_Levels.svg")))
         QtCore.QObject.connect(self.form.levels, QtCore.SIGNAL("itemClicked(QTreeWidgetItem *, int)"), self.editLevel)
@@ -60,7 +61,11 @@ class BIM_Levels_TaskPanel:
         QtCore.QObject.connect(self.form.restoreView, QtCore.SIGNAL("stateChanged(int)"), self.updateLevels)
         QtCore.QObject.connect(self.form.restoreState, QtCore.SIGNAL("stateChanged(int)"), self.updateLevels)
         QtCore.QObject.connect(self.form.buttonDelete, QtCore.SIGNAL("clicked()"), self.deleteLevels)
+        QtCore.QObject.connect(self.form.buttonAssign, QtCore.SIGNAL("clicked()"), self.assignObjects)
+        QtCore.QObject.connect(self.form.buttonDetect, QtCore.SIGNAL("clicked()"), self.detectLevels)
         self.form.levels.header().setResizeMode(0,QtGui.QHeaderView.Stretch)
+        tolerance = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetFloat("LevelTolerance",0)
+        self.form.levelTolerance.setText(FreeCAD.Units.Quantity(tolerance,FreeCAD.Units.Length).UserString)
         self.update()
 
     def getStandardButtons(self):
@@ -73,33 +78,98 @@ class BIM_Levels_TaskPanel:
         FreeCADGui.Control.closeDialog()
         FreeCAD.ActiveDocument.recompute()
 
-    def update(self,keepSelection=False):
+    def update(self):
 
-        sel = [it.toolTip(0) for it in self.form.levels.selectedItems()]
-        import Draft,Arch_rc
-        from PySide import QtGui
-        self.form.levels.clear()
-        levels = [o for o in FreeCAD.ActiveDocument.Objects if ( (Draft.getType(o) == "Floor") or ( (Draft.getType(o) == "BuildingPart") and (o.IfcRole in ["Building Storey","Undefined"])))]
-        for level in levels:
+        # only the rows of the levels that changed are updated
+        import BimLevelsData,BimIcons,Arch_rc
+        from PySide import QtCore,QtGui
+        self.readProposals()
+        levels = BimLevelsData.getLevels()
+        names = set([level.Name for level in levels])
+        items = {} # level name: row
+        for i in reversed(range(self.form.levels.topLevelItemCount())):
+            it = self.form.levels.topLevelItem(i)
+            if it.toolTip(0) in names:
+                items[it.toolTip(0)] = it
+            else:
+                # deleted levels, and detected levels that are added again below
+                self.form.levels.takeTopLevelItem(i)
+        for pos,level in enumerate(levels):
             s1 = level.Label
             s2 = FreeCAD.Units.Quantity(level.Placement.Base.z,FreeCAD.Units.Length).UserString
-            it = QtGui.QTreeWidgetItem([s1,s2])
-            it.setIcon(0,QtGui.QIcon(":/icons/Arch_Floor_Tree.svg"))
-            it.setToolTip(0,level.Name)
+            it = items.get(level.Name)
+            if it:
+                if it.text(0) != s1:
+                    it.setText(0,s1)
+                if it.text(1) != s2:
+                    it.setText(1,s2)
+            else:
+                it = QtGui.QTreeWidgetItem([s1,s2])
+                it.setIcon(0,BimIcons.getIcon(":/icons/Arch_Floor_Tree.svg"))
+                it.setToolTip(0,level.Name)
+                self.form.levels.insertTopLevelItem(pos,it)
+        # detected levels are shown in gray, and can be renamed and unchecked before creation
+        for i,proposal in enumerate(self.proposals):
+            s2 = FreeCAD.Units.Quantity(proposal["Elevation"],FreeCAD.Units.Length).UserString
+            it = QtGui.QTreeWidgetItem([proposal["Name"],s2])
+            it.setFlags(it.flags() | QtCore.Qt.ItemIsUserCheckable | QtCore.Qt.ItemIsEditable)
+            if proposal.get("Checked",True):
+                it.setCheckState(0,QtCore.Qt.Checked)
+            else:
+                it.setCheckState(0,QtCore.Qt.Unchecked)
+            it.setForeground(0,QtGui.QBrush(QtGui.QColor("gray")))
+            it.setForeground(1,QtGui.QBrush(QtGui.QColor("gray")))
+            it.setData(0,QtCore.Qt.UserRole,i)
             self.form.levels.addTopLevelItem(it)
-        if keepSelection and sel:
-            for i in range(self.form.levels.topLevelItemCount()):
-                it = self.form.levels.topLevelItem(i)
-                if it.toolTip(0) in sel:
-                    self.form.levels.setCurrentItem(it)
+
+    def getSelectedLevels(self):
+
+        levels = []
+        for it in self.form.levels.selectedItems():
+            level = FreeCAD.ActiveDocument.getObject(it.toolTip(0))
+            if level:
+                levels.append(level)
+        return levels
 
     def showLevel(self,item,column):
 
         level = FreeCAD.ActiveDocument.getObject(item.toolTip(0))
         if level:
-            if hasattr(level.Proxy,"show"):
+            if getattr(level,"RestoreState",False):
+                # show() would set the visibility of the whole document, so only the
+                # objects that change are written, and the view and working plane are
+                # restored here
+                self.setVisibility(level)
+                if getattr(level,"RestoreView",False) and hasattr(level.Proxy,"readCamera"):
+                    level.Proxy.readCamera()
+                FreeCADGui.Selection.clearSelection()
+                FreeCADGui.Selection.addSelection(level)
+                FreeCADGui.runCommand("Draft_SelectPlane")
+            elif hasattr(level.Proxy,"show"):
                 level.Proxy.show()
 
+    def setVisibility(self,level):
+
+        # only the objects whose visibility changes are written
+        import BimLevelsData
+        show,hide = BimLevelsData.getVisibility(level)
+        doc = level.Document
+        changes = []
+        for names,visibility in [(hide,False),(show,True)]:
+            for name in names:
+                obj = doc.getObject(name)
+                if obj and obj.ViewObject and (obj.ViewObject.Visibility != visibility):
+                    changes.append((obj.ViewObject,visibility))
+        if changes:
+            # written in one go, the widgets being repainted once at the end
+            mw = FreeCADGui.getMainWindow()
+            mw.setUpdatesEnabled(False)
+            try:
+                for vobj,visibility in changes:
+                    vobj.Visibility = visibility
+            finally:
+                mw.setUpdatesEnabled(True)
+
     def editLevel(self,item,column):
 
         if len(self.form.levels.selectedItems()) == 1:
@@ -110,10 +180,15 @@ class BIM_Levels_TaskPanel:
                 self.form.levelCoord.setText(FreeCAD.Units.Quantity(level.Placement.Base.z,FreeCAD.Units.Length).UserString)
                 if hasattr(level,"Height"):
                     self.form.levelHeight.setText(FreeCAD.Units.Quantity(level.Height,FreeCAD.Units.Length).UserString)
+                # filled without triggering updateLevels()
+                self.form.restoreView.blockSignals(True)
+                self.form.restoreState.blockSignals(True)
                 if hasattr(level,"RestoreView"):
                     self.form.restoreView.setChecked(level.RestoreView)
                 if hasattr(level,"RestoreState"):
                     self.form.restoreState.setChecked(level.RestoreState)
+                self.form.restoreView.blockSignals(False)
+                self.form.restoreState.blockSignals(False)
 
     def storeView(self):
 
@@ -126,42 +201,125 @@ class BIM_Levels_TaskPanel:
     def addLevel(self):
         
         import Arch
+        FreeCAD.ActiveDocument.openTransaction("Add level")
         level = Arch.makeFloor()
         self.setLevel(level)
+        FreeCAD.ActiveDocument.commitTransaction()
         self.update()
         
-    def setLevel(self,level):
-
-        if self.form.levelName.text():
-            level.Label = self.form.levelName.text()
+    def setLevel(self,level,label=None):
+
+        # only the values that differ are written. Returns True if the level was changed
+        import BimLevelsData
+        changed = False
+        if not label:
+            label = self.form.levelName.text()
+        if label and (level.Label != label):
+            level.Label = label
+            changed = True
         if self.form.levelCoord.text():
-            p = FreeCAD.Placement()
-            p.Base = FreeCAD.Vector(0,0,FreeCAD.Units.Quantity(self.form.levelCoord.text()).Value)
-            level.Placement = p
-        if self.form.levelHeight.text():
-            level.Height = FreeCAD.Units.Quantity(self.form.levelHeight.text()).Value
-        if hasattr(level,"RestoreView"):
-            level.RestoreView = self.form.restoreView.isChecked()
-        if hasattr(level,"RestoreState"):
-            level.RestoreState = self.form.restoreState.isChecked()
+            z = FreeCAD.Units.Quantity(self.form.levelCoord.text()).Value
+            if BimLevelsData.getElevation(level) != z:
+                BimLevelsData.setElevation(level,z)
+                changed = True
+        if self.form.levelHeight.text() and hasattr(level,"Height"):
+            height = FreeCAD.Units.Quantity(self.form.levelHeight.text()).Value
+            if float(level.Height) != height:
+                level.Height = height
+                changed = True
+        for prop,checkbox in [("RestoreView",self.form.restoreView),("RestoreState",self.form.restoreState)]:
+            if hasattr(level,prop) and (getattr(level,prop) != checkbox.isChecked()):
+                setattr(level,prop,checkbox.isChecked())
+                changed = True
+        return changed
 
     def updateLevels(self,arg=None):
         
-        for it in self.form.levels.selectedItems():
-            level = FreeCAD.ActiveDocument.getObject(it.toolTip(0))
-            if level:
-                self.setLevel(level)
-        self.update(keepSelection=True)
+        # all the selected levels are changed in one transaction
+        import BimLevelsData
+        levels = self.getSelectedLevels()
+        if not levels:
+            return
+        labels = {}
+        if "{" in self.form.levelName.text():
+            labels = BimLevelsData.getLabels(levels,self.form.levelName.text())
+        above = []
+        offset = 0
+        if (len(levels) == 1) and self.form.moveAbove.isChecked() and self.form.levelCoord.text():
+            offset = FreeCAD.Units.Quantity(self.form.levelCoord.text()).Value-BimLevelsData.getElevation(levels[0])
+            if offset:
+                above = BimLevelsData.getAbove(levels[0])
+        doc = FreeCAD.ActiveDocument
+        doc.openTransaction("Edit levels")
+        changed = [level for level in levels if self.setLevel(level,labels.get(level.Name))]
+        for level in above:
+            BimLevelsData.setElevation(level,BimLevelsData.getElevation(level)+offset)
+        changed.extend(above)
+        if not changed:
+            doc.abortTransaction()
+            return
+        doc.commitTransaction()
+        # only the edited levels are recomputed
+        for level in changed:
+            level.recompute()
+        self.update()
 
     def deleteLevels(self):
 
-        dels = []
-        for it in self.form.levels.selectedItems():
-            level = FreeCAD.ActiveDocument.getObject(it.toolTip(0))
-            if level:
-                dels.append(level.Name)
-        for d in dels:
-            FreeCAD.ActiveDocument.removeObject(d)
+        import BimLevelsData
+        BimLevelsData.remove(self.getSelectedLevels())
+        self.update()
+
+    def readProposals(self):
+
+        # keeps the names and check states of the detected levels changed in the list
+        from PySide import QtCore
+        for i in range(self.form.levels.topLevelItemCount()):
+            it = self.form.levels.topLevelItem(i)
+            p = it.data(0,QtCore.Qt.UserRole)
+            if (p is not None) and (p < len(self.proposals)):
+                self.proposals[p]["Name"] = it.text(0)
+                self.proposals[p]["Checked"] = (it.checkState(0) == QtCore.Qt.Checked)
+
+    def detectLevels(self):
+
+        import BimLevelsData
+        if self.proposals:
+            # the detected levels are shown already: create the checked ones
+            self.readProposals()
+            BimLevelsData.create([p for p in self.proposals if p.get("Checked",True)])
+            self.proposals = []
+            self.form.buttonDetect.setText("Detect")
+        else:
+            self.proposals = BimLevelsData.detect()
+            if self.proposals:
+                self.form.buttonDetect.setText("Create checked")
+            else:
+                FreeCAD.Console.PrintMessage("No levels found in this document\n")
+        self.update()
+
+    def assignObjects(self):
+
+        import BimLevelsData
+        tolerance = 0
+        if self.form.levelTolerance.text():
+            tolerance = FreeCAD.Units.Quantity(self.form.levelTolerance.text()).Value
+        FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetFloat("LevelTolerance",tolerance)
+        objs = [o for o in FreeCADGui.Selection.getSelection() if not BimLevelsData.isLevel(o)]
+        if not objs:
+            objs = BimLevelsData.getElements()
+        assignments,ambiguous,outside = BimLevelsData.sort(objs,tolerance=tolerance)
+        count = BimLevelsData.assign(assignments)
+        FreeCAD.Console.PrintMessage(str(count)+" objects placed in levels\n")
+        if ambiguous:
+            FreeCAD.Console.PrintWarning(str(len(ambiguous))+" objects could stand on several levels: "+", ".join([o.Label+" ("+" / ".join([l.Label for l in ls])+")" for o,ls in ambiguous])+"\n")
+        if outside:
+            FreeCAD.Console.PrintWarning(str(len(outside))+" objects are outside of all levels: "+", ".join([o.Label for o in outside])+"\n")
+        if ambiguous or outside:
+            # selected, so they can be placed by hand
+            FreeCADGui.Selection.clearSelection()
+            for obj in [o for o,ls in ambiguous]+outside:
+                FreeCADGui.Selection.addSelection(obj)
         self.update()
 
 
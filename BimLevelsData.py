@@ -0,0 +1,389 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+
+"""This module contains the operations on the levels (building storeys) of a document
+that don't depend on the GUI. For example, objects can be placed in the level they
+stand on, found from the bottom of their shape and the Z coordinate of the levels:
+
+    import BimLevelsData
+    assignments,ambiguous,outside = BimLevelsData.sort(BimLevelsData.getElements(),tolerance=50)
+    BimLevelsData.assign(assignments)
+
+Levels can also be proposed for documents that have none, such as imported models,
+from the elevations of their slabs, and created at once:
+
+    proposals = BimLevelsData.detect()
+    BimLevelsData.create(proposals)
+
+Many levels can be changed at once, each operation being one transaction:
+
+    levels = BimLevelsData.getLevels()
+    BimLevelsData.elevate(BimLevelsData.getAbove(levels[0]),500)
+    BimLevelsData.rename(levels,"Level {n}")
+    BimLevelsData.remove(levels[-2:])"""
+
+import FreeCAD,BimIndex
+from bisect import bisect_left,bisect_right
+
+# the types of the objects that contain other objects, and are never placed in a level
+containers = ["Floor","BuildingPart","Building","Site","Project"]
+
+
+def isLevel(obj):
+
+    "returns True if the given object is a level"
+
+    import Draft
+    t = Draft.getType(obj)
+    if t == "Floor":
+        return True
+    return (t == "BuildingPart") and (getattr(obj,"IfcRole",None) in ["Building Storey","Undefined"])
+
+
+def getLevels(doc=None):
+
+    "returns the levels of the given document (the active one by default), in document order"
+
+    index = BimIndex.getIndex(doc)
+    if not index:
+        return []
+    levels = index.getObjects(type="Floor")+index.getObjects(type="BuildingPart",role=["Building Storey","Undefined"])
+    return index.sort([o.Name for o in levels])
+
+
+def getElevation(level):
+
+    return level.Placement.Base.z
+
+
+def setElevation(level,z):
+
+    "changes the Z coordinate of a level, keeping the rest of its placement"
+
+    p = level.Placement
+    p.Base = FreeCAD.Vector(p.Base.x,p.Base.y,z)
+    level.Placement = p
+
+
+def getAbove(level,levels=None):
+
+    "returns the levels (of the document of the given level by default) higher than the given one"
+
+    if levels is None:
+        levels = getLevels(level.Document)
+    z = getElevation(level)
+    return [other for other in levels if getElevation(other) > z]
+
+
+def getLabels(levels,pattern,start=0):
+
+    """returns a {level name: label} dictionary, where each label is the given pattern,
+    with {n} replaced by the number of the level, from the bottom up, starting at start,
+    and {name} by its current label"""
+
+    labels = {}
+    for i,level in enumerate(sorted(levels,key=getElevation)):
+        labels[level.Name] = pattern.replace("{n}",str(i+start)).replace("{name}",level.Label)
+    return labels
+
+
+def getBottom(obj):
+
+    "returns the lowest Z coordinate of the shape of an object, or None if it has no shape"
+
+    if hasattr(obj,"Shape") and not obj.Shape.isNull():
+        return obj.Shape.BoundBox.ZMin
+    return None
+
+
+def getVisibility(level):
+
+    """returns the names of the objects to show and of the objects to hide so only the
+    given level is visible: the contents of the level, and the contents of the other
+    levels. Group-like objects are left out, since their visibility changes the one of
+    all their children. The contents of the levels are cached by BimIndex"""
+
+    index = BimIndex.getIndex(level.Document)
+    show = index.getDescendants(level.Name).difference(index.children)
+    hide = set()
+    for other in getLevels(level.Document):
+        if other.Name != level.Name:
+            hide.update(index.getDescendants(other.Name))
+    return show,hide.difference(index.children,show)
+
+
+def getElements(doc=None,reassign=False):
+
+    """returns the objects of the given document that can be placed in a level: the
+    objects with an IFC role and a shape that are not in a group, or only in a building
+    or a site, and are not part of another object. If reassign is True, the objects
+    already in a level are returned too"""
+
+    import Draft
+    index = BimIndex.getIndex(doc)
+    if not index:
+        return []
+    elements = []
+    for obj in index.getObjects(role=True):
+        if (Draft.getType(obj) in containers) or (getBottom(obj) is None):
+            continue
+        parent = index.getParent(obj)
+        if parent:
+            if isLevel(parent):
+                if not reassign:
+                    continue
+            elif not Draft.getType(parent) in containers:
+                continue
+        used = False
+        for o in obj.InList:
+            if (getattr(o,"Base",None) == obj) or (obj in getattr(o,"Additions",[])):
+                used = True
+                break
+        if not used:
+            elements.append(obj)
+    return elements
+
+
+def sort(objs,levels=None,tolerance=0):
+
+    """sorts the given objects by the level they stand on: the highest level whose Z
+    coordinate is below the bottom of the object, plus tolerance. Returns a {level name:
+    [objects]} dictionary of the objects that are not in their level yet, a list of
+    (object,[levels]) of the objects that could stand on several levels closer than
+    tolerance, and a list of the objects that have no shape, are below the lowest level,
+    or above the ceiling (Height) of the highest one"""
+
+    if levels is None:
+        levels = getLevels()
+    assignments = {}
+    ambiguous = []
+    outside = []
+    if not levels:
+        return assignments,ambiguous,list(objs)
+    levels = sorted(levels,key=getElevation)
+    elevations = [getElevation(level) for level in levels]
+    ceiling = None
+    if float(getattr(levels[-1],"Height",0)) > 0:
+        ceiling = elevations[-1]+float(levels[-1].Height)
+    index = BimIndex.getIndex(levels[0].Document)
+    for obj in objs:
+        z = getBottom(obj)
+        if z is None:
+            outside.append(obj)
+            continue
+        pos = bisect_right(elevations,z+tolerance)-1
+        if (pos < 0) or ((ceiling is not None) and (z+tolerance >= ceiling)):
+            outside.append(obj)
+            continue
+        # the other levels closer than tolerance to the object or to its level
+        near = bisect_left(elevations,min(z,elevations[pos])-tolerance)
+        if near < pos:
+            ambiguous.append((obj,levels[near:pos+1]))
+            continue
+        parent = index.getParent(obj)
+        if (not parent) or (parent.Name != levels[pos].Name):
+            assignments.setdefault(levels[pos].Name,[]).append(obj)
+    return assignments,ambiguous,outside
+
+
+def assign(assignments,doc=None):
+
+    """places the objects of a {level name: [objects]} dictionary, as returned by sort(),
+    in their level, in one transaction. Each group is changed only once. Returns the
+    number of moved objects"""
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    index = BimIndex.getIndex(doc)
+    levels = {}
+    leaving = {} # group name: names of the objects leaving it
+    for name,objs in assignments.items():
+        level = doc.getObject(name)
+        if level and objs:
+            levels[name] = level
+            for obj in objs:
+                parent = index.getParent(obj)
+                if parent and (parent.Name != name):
+                    leaving.setdefault(parent.Name,set()).add(obj.Name)
+    if not levels:
+        return 0
+    doc.openTransaction("Assign objects to levels")
+    for name,names in leaving.items():
+        group = doc.getObject(name)
+        group.Group = [o for o in group.Group if not o.Name in names]
+    count = 0
+    for name,level in levels.items():
+        names = set([o.Name for o in level.Group])
+        objs = [o for o in assignments[name] if not o.Name in names]
+        if objs:
+            level.Group = level.Group+objs
+            count += len(objs)
+    doc.commitTransaction()
+    doc.recompute()
+    return count
+
+
+def getHorizontals(objs):
+
+    """returns the bounding boxes of the horizontal solids among the given objects (slabs,
+    roofs...), that are thinner than half their width and depth, and the highest Z
+    coordinate of all the solids"""
+
+    import Draft
+    boxes = []
+    top = None
+    for obj in objs:
+        if (Draft.getType(obj) in containers) or (getBottom(obj) is None) or (not obj.Shape.Solids):
+            continue
+        bb = obj.Shape.BoundBox
+        if (top is None) or (bb.ZMax > top):
+            top = bb.ZMax
+        if bb.ZLength*2 <= min(bb.XLength,bb.YLength):
+            boxes.append(bb)
+    return boxes,top
+
+
+def detect(objs=None,resolution=100,minHeight=2000,threshold=0.05):
+
+    """proposes levels from the top faces of the horizontal objects, weighted by their
+    plan area. The tops are counted in a histogram with bins of the given resolution,
+    each group of adjacent bins giving one elevation. Groups weighing less than threshold
+    times the heaviest one are left out, as well as groups closer than minHeight to a
+    heavier one or to an existing level. Returns a list of {"Name","Elevation","Height",
+    "Weight"} dictionaries, from the bottom up"""
+
+    if objs is None:
+        objs = FreeCAD.ActiveDocument.Objects
+    boxes,top = getHorizontals(objs)
+    bins = {} # bin: [weight, sum of weighted elevations]
+    for bb in boxes:
+        b = bins.setdefault(int(bb.ZMax//resolution),[0,0])
+        w = bb.XLength*bb.YLength
+        b[0] += w
+        b[1] += w*bb.ZMax
+    groups = [] # [weight, elevation]
+    last = None
+    for key in sorted(bins):
+        w,wz = bins[key]
+        if (last is not None) and (key == last+1):
+            groups[-1][0] += w
+            groups[-1][1] += wz
+        else:
+            groups.append([w,wz])
+        last = key
+    if not groups:
+        return []
+    heaviest = max([g[0] for g in groups])
+    found = []
+    for w,wz in groups:
+        if w < threshold*heaviest:
+            continue
+        z = wz/w
+        if found and (z-found[-1][1] < minHeight):
+            if w > found[-1][0]:
+                found[-1] = [w,z]
+        else:
+            found.append([w,z])
+    existing = sorted([getElevation(level) for level in getLevels()])
+    found = [(w,z) for w,z in found if not [e for e in existing if abs(e-z) < minHeight]]
+    # levels are numbered from the first one above the ground
+    ground = 0
+    while (ground < len(found)-1) and (found[ground][1] < -resolution):
+        ground += 1
+    proposals = []
+    for i,(w,z) in enumerate(found):
+        if i+1 < len(found):
+            height = found[i+1][1]-z
+        elif top-z >= minHeight:
+            height = top-z
+        else:
+            height = 0
+        proposals.append({"Name":"Level "+str(i-ground),"Elevation":z,"Height":height,"Weight":w})
+    return proposals
+
+
+def create(proposals):
+
+    "creates levels in the active document from the given proposals, in one transaction. Returns the new levels"
+
+    import Arch
+    if not proposals:
+        return []
+    doc = FreeCAD.ActiveDocument
+    doc.openTransaction("Create levels")
+    levels = []
+    for proposal in proposals:
+        level = Arch.makeFloor()
+        level.Label = proposal["Name"]
+        level.Placement = FreeCAD.Placement(FreeCAD.Vector(0,0,proposal["Elevation"]),FreeCAD.Rotation())
+        if proposal["Height"]:
+            level.Height = proposal["Height"]
+        levels.append(level)
+    doc.commitTransaction()
+    doc.recompute()
+    return levels
+
+
+def elevate(levels,offset):
+
+    "moves the given levels up by offset, in one transaction"
+
+    if not levels:
+        return
+    doc = levels[0].Document
+    doc.openTransaction("Move levels")
+    for level in levels:
+        setElevation(level,getElevation(level)+offset)
+    doc.commitTransaction()
+    for level in levels:
+        level.recompute()
+
+
+def rename(levels,pattern,start=0):
+
+    "renames the given levels with a pattern (see getLabels), in one transaction"
+
+    if not levels:
+        return
+    doc = levels[0].Document
+    labels = getLabels(levels,pattern,start)
+    doc.openTransaction("Rename levels")
+    for level in levels:
+        if level.Label != labels[level.Name]:
+            level.Label = labels[level.Name]
+    doc.commitTransaction()
+
+
+def remove(levels):
+
+    "deletes the given levels, in one transaction. Their contents are kept"
+
+    if not levels:
+        return
+    doc = levels[0].Document
+    doc.openTransaction("Delete levels")
+    for name in [level.Name for level in levels]:
+        doc.removeObject(name)
+    doc.commitTransaction()
+    doc.recompute()
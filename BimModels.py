@@ -0,0 +1,130 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+
+"""This module contains the base of the item models of the BIM dialogs that show
+large trees, and expose their rows to the views only as they get scrolled to or
+expanded."""
+
+from PySide import QtCore
+
+
+
+class LazyTreeModel(QtCore.QAbstractItemModel):
+
+
+    """a tree model whose nodes are integers, and whose rows are exposed to the views
+    in batches. Subclasses provide getChildren() and getParent(), and keep the position
+    of each node in its parent in self.positions"""
+
+    # number of rows fetched at once by the views
+    batch = 1000
+
+    def clear(self):
+
+        # nodes are integers, 0 being the root. The internalId of a model index is
+        # the node of its parent.
+        self.positions = {} # node: position in its parent
+        self.fetched = {} # node: number of children already exposed to the views
+
+    def getChildren(self,node):
+
+        "returns the list of child nodes of the given node"
+
+        return []
+
+    def getParent(self,node):
+
+        "returns the parent node of the given node"
+
+        return 0
+
+    def getNode(self,index):
+
+        if not index.isValid():
+            return 0
+        return self.getChildren(index.internalId())[index.row()]
+
+    def getIndex(self,node,column=0):
+
+        "returns the model index of the given node, if it has been fetched by the views"
+
+        if node == 0:
+            return QtCore.QModelIndex()
+        parent = self.getParent(node)
+        pos = self.positions[node]
+        if (pos < 0) or (pos >= self.fetched.get(parent,0)):
+            return QtCore.QModelIndex()
+        return self.createIndex(pos,column,parent)
+
+    def isExposed(self,node):
+
+        "returns True if the views know about the given node, ie. it and all its ancestors have been fetched"
+
+        while node != 0:
+            parent = self.getParent(node)
+            if not (0 <= self.positions[node] < self.fetched.get(parent,0)):
+                return False
+            node = parent
+        return True
+
+    # QAbstractItemModel interface
+
+    def index(self,row,column,parent=QtCore.QModelIndex()):
+
+        if not self.hasIndex(row,column,parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row,column,self.getNode(parent))
+
+    def parent(self,index):
+
+        if (not index.isValid()) or (index.internalId() == 0):
+            return QtCore.QModelIndex()
+        return self.getIndex(index.internalId())
+
+    def rowCount(self,parent=QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return 0
+        return self.fetched.get(self.getNode(parent),0)
+
+    def hasChildren(self,parent=QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return False
+        return bool(self.getChildren(self.getNode(parent)))
+
+    def canFetchMore(self,parent):
+
+        node = self.getNode(parent)
+        return self.fetched.get(node,0) < len(self.getChildren(node))
+
+    def fetchMore(self,parent):
+
+        node = self.getNode(parent)
+        first = self.fetched.get(node,0)
+        last = min(len(self.getChildren(node)),first+self.batch)-1
+        if last >= first:
+            self.beginInsertRows(parent,first,last)
+            self.fetched[node] = last+1
+            self.endInsertRows()
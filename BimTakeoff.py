@@ -0,0 +1,155 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+"""This module contains the quantity take-off engine of the BIM workbench.
+
+It doesn't depend on the GUI, so it can be used from FreeCADCmd, for example:
+
+    import BimTakeoff
+    BimTakeoff.writeCSV(BimTakeoff.takeoffFiles(["a.FCStd","b.FCStd"]),"quantities.csv")
+
+Quantities are given in FreeCAD internal units (mm, mm², mm³)."""
+
+import sys,FreeCAD
+
+qprops = ["Length","Width","Height","Area","HorizontalArea","VerticalArea","Volume"]
+qunits = ["Length","Length","Length","Area","Area","Area","Volume"] # the FreeCAD.Units of each qprop
+
+
+def isQuantifiable(obj):
+
+    "returns True if quantities can be taken off the given object"
+
+    import Draft
+    return hasattr(obj,"IfcRole") and obj.isDerivedFrom("Part::Feature") and (Draft.getType(obj) != "Site")
+
+
+def getQuantities(obj,volume=True):
+
+    """returns a list with the value of each of the qprops of the given object, None if
+    not available. The volume, which can be expensive to compute, is skipped if volume
+    is False"""
+
+    values = []
+    for prop in qprops:
+        val = None
+        if prop == "Volume":
+            if volume and obj.Shape and hasattr(obj.Shape,"Volume"):
+                val = obj.Shape.Volume
+        elif hasattr(obj,prop) and (not "Hidden" in obj.getEditorMode(prop)):
+            val = getattr(obj,prop).Value
+        values.append(val)
+    return values
+
+
+def hasQuantity(obj,prop):
+
+    "returns True if the given qprop is available on the given object, without computing its volume"
+
+    if prop == "Volume":
+        return bool(obj.Shape) and hasattr(obj.Shape,"Volume")
+    return hasattr(obj,prop) and (not "Hidden" in obj.getEditorMode(prop))
+
+
+def getExports(obj):
+
+    "returns a list of booleans telling which of the qprops of the given object are exported to IFC"
+
+    if not hasattr(obj,"IfcAttributes"):
+        return [False for prop in qprops]
+    return [obj.IfcAttributes.get("Export"+prop,"") == "True" for prop in qprops]
+
+
+def takeoff(doc=None,objs=None,exported=False):
+
+    """yields a dictionary with the name, label, IFC role and quantities of each
+    quantifiable object of the given document (the active one by default), or of the
+    given list of objects. If exported is True, only the quantities flagged for IFC
+    export are given, the others being None"""
+
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    if objs is None:
+        objs = doc.Objects
+    for obj in objs:
+        if isQuantifiable(obj):
+            values = getQuantities(obj)
+            if exported:
+                values = [val if exp else None for val,exp in zip(values,getExports(obj))]
+            row = {"Document":obj.Document.Name,"Name":obj.Name,"Label":obj.Label,"IfcRole":obj.IfcRole}
+            row.update(zip(qprops,values))
+            yield row
+
+
+def takeoffFiles(filenames,exported=False):
+
+    """yields the take-off rows of each of the given FreeCAD files, which are opened
+    one at a time and closed afterwards, so memory use doesn't grow with their number"""
+
+    for filename in filenames:
+        doc = FreeCAD.openDocument(filename)
+        try:
+            for row in takeoff(doc,exported=exported):
+                yield row
+        finally:
+            FreeCAD.closeDocument(doc.Name)
+
+
+def writeCSV(rows,filename):
+
+    "writes the given take-off rows to a CSV file, as they come. Returns the number of rows"
+
+    import csv
+    fields = ["Document","Name","Label","IfcRole"]+qprops
+    if sys.version_info.major < 3:
+        f = open(filename,"wb")
+    else:
+        f = open(filename,"w",newline="")
+    count = 0
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for row in rows:
+            values = [row[field] for field in fields]
+            if sys.version_info.major < 3:
+                values = [v.encode("utf8") if isinstance(v,unicode) else v for v in values]
+            writer.writerow(["" if v is None else v for v in values])
+            count += 1
+    return count
+
+
+def writeJSON(rows,filename):
+
+    "writes the given take-off rows to a JSON file as a list of objects, as they come. Returns the number of rows"
+
+    import json
+    count = 0
+    with open(filename,"w") as f:
+        f.write("[")
+        for row in rows:
+            if count:
+                f.write(",")
+            f.write("\n"+json.dumps(row))
+            count += 1
+        f.write("\n]\n")
+    return count
@@ -84,14 +84,13 @@ def update():
     if vm:
         if vm.isVisible():
             vm.clear()
-            import Draft
+            import BimIndex
             from PySide import QtGui
-            for obj in FreeCAD.ActiveDocument.Objects:
-                if Draft.getType(obj) == "WorkingPlaneProxy":
-                    it = QtGui.QListWidgetItem(vm)
-                    it.setText(obj.Label)
-                    it.setToolTip(obj.Name)
-                    it.setIcon(QtGui.QIcon(obj.ViewObject.Proxy.getIcon()))
+            for obj in BimIndex.getObjects(type="WorkingPlaneProxy"):
+                it = QtGui.QListWidgetItem(vm)
+                it.setText(obj.Label)
+                it.setToolTip(obj.Name)
+                it.setIcon(QtGui.QIcon(obj.ViewObject.Proxy.getIcon()))
 
 def show(item):
     
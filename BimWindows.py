@@ -74,16 +74,16 @@ class BIM_Windows_TaskPanel:
 
     def update(self,index=None):
         
-        import Draft,Arch_rc
+        import BimIndex,BimIcons,Arch_rc
         from PySide import QtGui
         self.form.windows.clear()
-        windows = [o for o in FreeCAD.ActiveDocument.Objects if Draft.getType(o) == "Window"]
+        windows = BimIndex.getObjects(type="Window")
         if self.form.groupMode.currentIndex() == 0:
             for window in windows:
                 s1 = window.Label
                 s2 = window.Tag
                 it = QtGui.QTreeWidgetItem([s1,s2])
-                it.setIcon(0,QtGui.QIcon(":/icons/Arch_Window_Tree.svg"))
+                it.setIcon(0,BimIcons.getIcon(":/icons/Arch_Window_Tree.svg"))
                 it.setToolTip(0,window.Name)
                 self.form.windows.addTopLevelItem(it)
         else:
@@ -117,7 +117,7 @@ class BIM_Windows_TaskPanel:
                     s1 = window.Label
                     s2 = window.Tag
                     it = QtGui.QTreeWidgetItem([s1,s2])
-                    it.setIcon(0,QtGui.QIcon(":/icons/Arch_Window_Tree.svg"))
+                    it.setIcon(0,BimIcons.getIcon(":/icons/Arch_Window_Tree.svg"))
                     it.setToolTip(0,window.Name)
                     top.addChild(it)
             self.form.windows.expandAll()
@@ -211,19 +211,19 @@ class BIM_Windows_TaskPanel:
 
     def setMaterial(self):
 
-        import Draft,Arch_rc
+        import BimIndex,BimIcons,Arch_rc
         from PySide import QtGui
         form = FreeCADGui.PySideUic.loadUi(os.path.join(os.path.dirname(__file__),"dialogMaterialChooser.ui"))
         mw = FreeCADGui.getMainWindow()
         form.move(mw.frameGeometry().topLeft() + mw.rect().center() - form.rect().center())
-        materials = [o for o in FreeCAD.ActiveDocument.Objects if Draft.getType(o) == "Material"]
+        materials = BimIndex.getObjects(type="Material")
         it = QtGui.QListWidgetItem("None")
-        it.setIcon(QtGui.QIcon(":/icons/button_invalid.svg"))
+        it.setIcon(BimIcons.getIcon(":/icons/button_invalid.svg"))
         it.setToolTip("__None__")
         form.list.addItem(it)
         for mat in materials:
             it = QtGui.QListWidgetItem(mat.Label)
-            it.setIcon(QtGui.QIcon(":/icons/Arch_Material.svg"))
+            it.setIcon(BimIcons.getIcon(":/icons/Arch_Material.svg"))
             it.setToolTip(mat.Name)
             form.list.addItem(it)
         result = form.exec_()
@@ -224,6 +224,7 @@ static char * IFC_xpm[] = {
         if FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetBool("FirstTime",True):
             todo.delay(FreeCADGui.runCommand,"BIM_Welcome")
         todo.delay(BimCommands.setStatusIcons,True)
+        todo.delay(BimCommands.BimClassification.preload,None)
         if not hasattr(FreeCAD,"BimDocumentObserver"):
             FreeCAD.BimDocumentObserver = BimCommands.BimDocumentObserver()
             FreeCAD.addDocumentObserver(FreeCAD.BimDocumentObserver)
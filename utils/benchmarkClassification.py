@@ -0,0 +1,92 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2018 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This script generates a classification system with 100000 items, plain and
+gzip-compressed, in a temporary folder, and measures the time taken to parse it
+and to reload it from the cache.
+Run it from the command line: python benchmarkClassification.py [number of items]"""
+
+from __future__ import print_function
+
+import os,sys,time,gzip,shutil,tempfile
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import BimClassificationData
+
+
+def generate(filename,count):
+
+    "writes a classification file with count items, three levels deep"
+
+    f = open(filename,"w")
+    f.write('<?xml version="1.0" encoding="utf-8"?>\n<Classification>\n<Items>\n')
+    n = 0
+    i = 0
+    while n < count:
+        f.write("<Item>\n<ID>Ss_%d</ID>\n<Name>System group %d</Name>\n<Children>\n" % (i,i))
+        n += 1
+        for j in range(50):
+            if n >= count:
+                break
+            f.write("<Item><ID>Ss_%d_%d</ID><Name>System &amp; subgroup %d</Name><Children>" % (i,j,j))
+            n += 1
+            for k in range(40):
+                if n >= count:
+                    break
+                f.write("<Item><ID>Ss_%d_%d_%d</ID><Description>Product %d</Description></Item>" % (i,j,k,k))
+                n += 1
+            f.write("</Children></Item>\n")
+        f.write("</Children>\n</Item>\n")
+        i += 1
+    f.write("</Items>\n</Classification>\n")
+    f.close()
+
+
+def measure(filename,function):
+
+    t = time.time()
+    result = function(filename)
+    return result,time.time()-t
+
+
+if __name__ == "__main__":
+
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    folder = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(folder,"benchmark.xml")
+        generate(filename,count)
+        with open(filename,"rb") as src:
+            with gzip.open(filename+".gz","wb") as dst:
+                shutil.copyfileobj(src,dst)
+        for f in [filename,filename+".gz"]:
+            result,t = measure(f,lambda f: sum(1 for item in BimClassificationData.iterItems(f)))
+            print("%s: %d items streamed in %.3f s" % (os.path.basename(f),result,t))
+            result,t = measure(f,BimClassificationData.build)
+            print("%s: tree of %d items, %d at the top level, built in %.3f s" % (os.path.basename(f),len(result),len(result.getChildren()),t))
+            result,t = measure(f,BimClassificationData.load)
+            print("%s: parsed and cached in %.3f s" % (os.path.basename(f),t))
+            result,t = measure(f,BimClassificationData.load)
+            print("%s: loaded from the cache in %.3f s" % (os.path.basename(f),t))
+    finally:
+        shutil.rmtree(folder)